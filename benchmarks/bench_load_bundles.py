@@ -0,0 +1,53 @@
+"""Compare loading Synthea-like patient bundles with a Bundle model and dict round-trip against `SimpleFHIRStore.load_bundles`.
+
+    PYTHONPATH=. python benchmarks/bench_load_bundles.py [n_bundles] [repeat]
+"""
+import logging
+import sys
+import tempfile
+import timeit
+from pathlib import Path
+
+from pydantic import parse_file_as, parse_obj_as
+
+from fhirkit import SimpleFHIRStore
+from fhirkit.Bundle import Bundle
+from fhirkit.parse import AnyPatientResource
+from synthetic import write_bundles
+
+
+def load_with_round_trip(path: Path):
+    """The loader before the single-pass implementation: every resource is validated twice."""
+    resources = []
+    for fpath in path.glob("*.json"):
+        bundle = parse_file_as(Bundle, fpath)
+        for entry in bundle.entry:
+            resources.append(parse_obj_as(AnyPatientResource, entry.resource.dict()))
+    return resources
+
+
+def main(n_bundles: int = 50, repeat: int = 3):
+    logging.disable(logging.WARNING)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp)
+        write_bundles(path, n_bundles)
+        n_resources = len(SimpleFHIRStore.load_bundles(path))
+        assert n_resources == len(load_with_round_trip(path))
+
+        round_trip_time = min(
+            timeit.repeat(lambda: load_with_round_trip(path), number=1, repeat=repeat)
+        )
+        single_pass_time = min(
+            timeit.repeat(
+                lambda: SimpleFHIRStore.load_bundles(path), number=1, repeat=repeat
+            )
+        )
+
+    print(f"{n_bundles} bundles, {n_resources} resources, best of {repeat}")
+    print(f"Bundle model + dict round-trip: {1000 * round_trip_time / n_bundles:.1f} ms/bundle")
+    print(f"single pass:                    {1000 * single_pass_time / n_bundles:.1f} ms/bundle")
+    print(f"speedup: {round_trip_time / single_pass_time:.2f}x")
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
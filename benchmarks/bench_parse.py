@@ -0,0 +1,39 @@
+"""Compare the discriminated Union validation with the resourceType dispatch of `parse_json_as_resource`.
+
+    PYTHONPATH=. python benchmarks/bench_parse.py [n_patients] [repeat]
+"""
+import json
+import sys
+import tempfile
+import timeit
+from pathlib import Path
+
+from pydantic import parse_obj_as
+
+from fhirkit.parse import AnyPatientResource, parse_json_as_resource
+from synthetic import write_ndjson
+
+
+def main(n_patients: int = 1000, repeat: int = 3):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "mixed.ndjson"
+        n_lines = write_ndjson(path, n_patients)
+        lines = path.read_text().splitlines()
+
+    def union():
+        return [parse_obj_as(AnyPatientResource, json.loads(line)) for line in lines]
+
+    def dispatch():
+        return [parse_json_as_resource(line) for line in lines]
+
+    assert union() == dispatch()
+    union_time = min(timeit.repeat(union, number=1, repeat=repeat))
+    dispatch_time = min(timeit.repeat(dispatch, number=1, repeat=repeat))
+    print(f"{n_lines} lines, best of {repeat}")
+    print(f"discriminated Union:   {union_time:.2f}s ({n_lines / union_time:.0f} lines/sec)")
+    print(f"resourceType dispatch: {dispatch_time:.2f}s ({n_lines / dispatch_time:.0f} lines/sec)")
+    print(f"speedup: {union_time / dispatch_time:.2f}x")
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
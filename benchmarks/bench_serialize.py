@@ -0,0 +1,73 @@
+"""Compare pydantic's `_iter` based `dict()`/`json()` with the serializer that is compiled once per model class,
+and `json()` with `json_bytes()`, which writes the JSON without building a dict first.
+
+    PYTHONPATH=. python benchmarks/bench_serialize.py [n_patients] [repeat]
+"""
+import json
+import sys
+import timeit
+import tracemalloc
+from unittest import mock
+
+import fhirkit.BaseModel
+from fhirkit.Bundle import Bundle
+from fhirkit.parse import parse_obj_as_resource
+from synthetic import patient_bundle, patient_resources
+
+
+def main(n_patients: int = 200, repeat: int = 3):
+    observations = [
+        parse_obj_as_resource(r)
+        for i in range(n_patients)
+        for r in patient_resources(i)
+        if r["resourceType"] == "Observation"
+    ]
+    bundles = [Bundle.parse_obj(patient_bundle(i)) for i in range(n_patients // 10 or 1)]
+
+    cases = {
+        "Observation.dict()": lambda: [o.dict() for o in observations],
+        "Observation.json()": lambda: [o.json() for o in observations],
+        "Bundle.json()": lambda: [b.json() for b in bundles],
+    }
+    print(f"{len(observations)} observations, {len(bundles)} bundles, best of {repeat}")
+    for name, case in cases.items():
+        compiled = case()
+        compiled_time = min(timeit.repeat(case, number=1, repeat=repeat))
+        # without a compiled serializer every model falls back to pydantic's _iter
+        with mock.patch.object(fhirkit.BaseModel, "_model_serializer", lambda cls: None):
+            assert case() == compiled
+            iter_time = min(timeit.repeat(case, number=1, repeat=repeat))
+        print(
+            f"{name:20} _iter: {1000 * iter_time:8.1f} ms  compiled: {1000 * compiled_time:8.1f} ms"
+            f"  speedup: {iter_time / compiled_time:.2f}x"
+        )
+
+    bundle = Bundle.parse_obj(
+        {"resourceType": "Bundle", "type": "collection", "entry": [e for b in bundles for e in b.entry]}
+    )
+    cases = {
+        "Observation": (
+            lambda: b"\n".join(o.json().encode() for o in observations),
+            lambda: b"\n".join(o.json_bytes() for o in observations),
+        ),
+        "Bundle": (lambda: bundle.json().encode(), lambda: bundle.json_bytes()),
+    }
+    for name, (to_json, to_bytes) in cases.items():
+        decoded = [json.loads(line) for line in to_json().splitlines()]
+        assert decoded == [json.loads(line) for line in to_bytes().splitlines()]
+        json_time = min(timeit.repeat(to_json, number=1, repeat=repeat))
+        bytes_time = min(timeit.repeat(to_bytes, number=1, repeat=repeat))
+        print(
+            f"{name:20} json(): {1000 * json_time:8.1f} ms  json_bytes(): {1000 * bytes_time:8.1f} ms"
+            f"  speedup: {json_time / bytes_time:.2f}x"
+        )
+    for name, case in (("json()", cases["Bundle"][0]), ("json_bytes()", cases["Bundle"][1])):
+        tracemalloc.start()
+        case()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f"peak memory of Bundle.{name}: {peak / 2 ** 20:.1f} MiB")
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,104 @@
+"""Generate Synthea-like FHIR data to benchmark parsing and serialisation."""
+import json
+import random
+from pathlib import Path
+from typing import Any, Dict, Iterator, List
+
+LOINC = "http://loinc.org"
+SNOMED = "http://snomed.info/sct"
+
+
+def patient(i: int) -> Dict[str, Any]:
+    return {
+        "resourceType": "Patient",
+        "id": f"patient-{i}",
+        "identifier": [{"system": "https://github.com/synthetichealth/synthea", "value": f"mrn-{i}"}],
+        "name": [{"use": "official", "family": f"Family{i}", "given": [f"Given{i}"]}],
+        "gender": random.choice(["male", "female"]),
+        "birthDate": f"19{random.randint(20, 99)}-0{random.randint(1, 9)}-1{random.randint(0, 9)}",
+    }
+
+
+def encounter(i: int, patient_id: str) -> Dict[str, Any]:
+    return {
+        "resourceType": "Encounter",
+        "id": f"encounter-{i}",
+        "status": "finished",
+        "class": {"system": "http://terminology.hl7.org/CodeSystem/v3-ActCode", "code": "AMB"},
+        "type": [{"coding": [{"system": SNOMED, "code": "185349003", "display": "Encounter for check up"}]}],
+        "subject": {"reference": f"Patient/{patient_id}"},
+        "period": {"start": "2019-02-02T10:00:00+01:00", "end": "2019-02-02T10:30:00+01:00"},
+    }
+
+
+def observation(i: int, patient_id: str) -> Dict[str, Any]:
+    return {
+        "resourceType": "Observation",
+        "id": f"observation-{i}",
+        "status": "final",
+        "category": [{"coding": [{"system": "http://terminology.hl7.org/CodeSystem/observation-category", "code": "laboratory"}]}],
+        "code": {"coding": [{"system": LOINC, "code": "2160-0", "display": "Creatinine"}], "text": "Creatinine"},
+        "subject": {"reference": f"Patient/{patient_id}"},
+        "effectiveDateTime": "2019-02-02T10:00:00+01:00",
+        "valueQuantity": {"value": round(random.uniform(0.5, 1.5), 2), "unit": "mg/dL", "system": "http://unitsofmeasure.org", "code": "mg/dL"},
+    }
+
+
+def condition(i: int, patient_id: str) -> Dict[str, Any]:
+    return {
+        "resourceType": "Condition",
+        "id": f"condition-{i}",
+        "clinicalStatus": {"coding": [{"system": "http://terminology.hl7.org/CodeSystem/condition-clinical", "code": "active"}]},
+        "code": {"coding": [{"system": SNOMED, "code": "44054006", "display": "Diabetes"}], "text": "Diabetes"},
+        "subject": {"reference": f"Patient/{patient_id}"},
+        "onsetDateTime": "2012-05-01T10:00:00+01:00",
+    }
+
+
+def procedure(i: int, patient_id: str) -> Dict[str, Any]:
+    return {
+        "resourceType": "Procedure",
+        "id": f"procedure-{i}",
+        "status": "completed",
+        "code": {"coding": [{"system": SNOMED, "code": "430193006", "display": "Medication reconciliation"}]},
+        "subject": {"reference": f"Patient/{patient_id}"},
+        "performed": {"start": "2019-02-02T10:00:00+01:00", "end": "2019-02-02T10:15:00+01:00"},
+    }
+
+
+def patient_resources(i: int, n_per_type: int = 5) -> Iterator[Dict[str, Any]]:
+    """All resources of a single synthetic patient."""
+    p = patient(i)
+    yield p
+    for j in range(n_per_type):
+        k = i * n_per_type + j
+        yield encounter(k, p["id"])
+        yield observation(k, p["id"])
+        yield condition(k, p["id"])
+        yield procedure(k, p["id"])
+
+
+def write_ndjson(path: Path, n_patients: int) -> int:
+    """Write a mixed-resource NDJSON file and return the number of lines."""
+    n_lines = 0
+    with open(path, "w") as f:
+        for i in range(n_patients):
+            for resource in patient_resources(i):
+                f.write(json.dumps(resource) + "\n")
+                n_lines += 1
+    return n_lines
+
+
+def patient_bundle(i: int) -> Dict[str, Any]:
+    """A transaction Bundle as written by Synthea for a single patient."""
+    entries: List[Dict[str, Any]] = [
+        {"fullUrl": f"urn:uuid:{r['id']}", "resource": r}
+        for r in patient_resources(i, n_per_type=20)
+    ]
+    return {"resourceType": "Bundle", "type": "transaction", "entry": entries}
+
+
+def write_bundles(directory: Path, n_patients: int) -> None:
+    for i in range(n_patients):
+        with open(directory / f"patient-{i}.json", "w") as f:
+            json.dump(patient_bundle(i), f)
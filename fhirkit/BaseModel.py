@@ -5,23 +5,312 @@ from typing import (
     Dict,
     Generator,
     Mapping,
+    NamedTuple,
     Optional,
     Tuple,
+    Type,
     Union,
     cast,
 )
+from functools import lru_cache
+import json
+from json.encoder import encode_basestring
 import warnings
 import pydantic
 
-from pydantic.utils import ROOT_KEY
+from pydantic.fields import SHAPE_LIST, SHAPE_SEQUENCE, SHAPE_SINGLETON, ModelField
+from pydantic.typing import is_namedtuple
+from pydantic.utils import ROOT_KEY, lenient_issubclass, sequence_like
 
-from fhirkit.choice_type.validators import TYPE_NAME_ALIAS, get_matching_type
+from fhirkit.choice_type.validators import ChoiceTypeKeys
+from fhirkit.json_backend import json_dumps
 
 IntStr = Union[int, str]
 AbstractSetIntStr = AbstractSet[IntStr]
 MappingIntStrAny = Mapping[IntStr, Any]
 DictStrAny = Dict[str, Any]
 
+# how the value of a field is converted, decided once per model class
+_VALUE, _MODEL, _MODEL_SEQUENCE = range(3)
+_MISSING = object()
+# the values that are dropped with exclude_empty when they have no items, after the conversion to dicts
+_SIZED = (str, bytes, list, tuple, dict, set, frozenset)
+_SCALARS = frozenset((str, int, float, bool))
+# the encoding of the values dropped with exclude_empty
+_EMPTY_JSON = (b'""', b"[]", b"{}")
+
+
+@lru_cache(maxsize=None)
+def _choice_fields(cls: type) -> Dict[str, ChoiceTypeKeys]:
+    """The FHIR keys of the choice type fields of a model class by the type of their value."""
+    return {
+        name: ChoiceTypeKeys(field)
+        for name, field in cls.__fields__.items()
+        if field.field_info.extra.get("choice_type", False)
+    }
+
+
+class _FieldSerializer(NamedTuple):
+    name: str
+    alias: str
+    kind: int
+    # the keys of a choice type by the type of the value
+    choice: Optional[ChoiceTypeKeys]
+    # the JSON encoded keys, followed by a colon
+    name_key: bytes
+    alias_key: bytes
+    choice_keys: Optional[Dict[type, bytes]]
+
+
+def _json_key(key: str) -> bytes:
+    return encode_basestring(key).encode() + b":"
+
+
+class _ModelSerializer:
+    """Converts instances of a model class to dicts like `BaseModel.dict` without include/exclude options does,
+    with the shape of the fields, their aliases and the excluded fields worked out up front."""
+
+    def __init__(self, cls: Type["BaseModel"]) -> None:
+        excluded = cls.__exclude_fields__ or {}
+        choices = _choice_fields(cls)
+        self.fields = tuple(
+            _FieldSerializer(
+                name,
+                field.alias,
+                _field_kind(field),
+                choices.get(name),
+                _json_key(name),
+                _json_key(field.alias),
+                {} if name in choices else None,
+            )
+            for name, field in cls.__fields__.items()
+            if excluded.get(name) is not True
+        )
+        self.field_names = frozenset(cls.__fields__)
+
+    def dict(
+        self, model: "BaseModel", by_alias: bool, exclude_none: bool, exclude_empty: bool
+    ) -> DictStrAny:
+        values = model.__dict__
+        data = {}
+        for name, alias, kind, choice, _, _, _ in self.fields:
+            value = values.get(name, _MISSING)
+            if value is None:
+                if exclude_none or exclude_empty:
+                    continue
+            elif value is _MISSING:
+                continue
+            elif kind is _MODEL_SEQUENCE:
+                value = _sequence_to_dict(value, by_alias, exclude_none)
+            elif kind is _MODEL:
+                value = _model_to_dict(value, by_alias, exclude_none)
+            elif type(value) not in _SCALARS:
+                value = _value_to_dict(value, by_alias, exclude_none)
+            if exclude_empty and isinstance(value, _SIZED) and not value:
+                continue
+            if by_alias:
+                if choice is not None and value is not None:
+                    alias = choice[type(values[name])]
+                data[alias] = value
+            else:
+                data[name] = value
+        # extra fields, which are allowed on resources
+        if len(values) != len(self.field_names) or not values.keys() <= self.field_names:
+            for name, value in values.items():
+                if name in self.field_names:
+                    continue
+                if value is None and (exclude_none or exclude_empty):
+                    continue
+                value = _value_to_dict(value, by_alias, exclude_none)
+                if exclude_empty and isinstance(value, _SIZED) and not value:
+                    continue
+                data[name] = value
+        return data
+
+    def write(
+        self,
+        model: "BaseModel",
+        out: bytearray,
+        by_alias: bool,
+        exclude_none: bool,
+        exclude_empty: bool,
+        default: Callable[[Any], Any],
+    ) -> None:
+        """Write the JSON of the dict that `dict` returns to `out`, without building the dict."""
+        values = model.__dict__
+        out += b"{"
+        start = len(out)
+        for name, _, kind, choice, name_key, alias_key, choice_keys in self.fields:
+            value = values.get(name, _MISSING)
+            if value is _MISSING or (value is None and (exclude_none or exclude_empty)):
+                continue
+            mark = len(out)
+            if mark != start:
+                out += b","
+            if not by_alias:
+                out += name_key
+            elif choice is not None and value is not None:
+                key = choice_keys.get(type(value))
+                if key is None:
+                    key = choice_keys[type(value)] = _json_key(choice[type(value)])
+                out += key
+            else:
+                out += alias_key
+            value_start = len(out)
+            if value is None:
+                out += b"null"
+            elif kind is _MODEL_SEQUENCE and type(value) is list:
+                out += b"["
+                for i, item in enumerate(value):
+                    if i:
+                        out += b","
+                    _write_model(item, out, by_alias, exclude_none, default)
+                out += b"]"
+            elif kind is _MODEL:
+                _write_model(value, out, by_alias, exclude_none, default)
+            else:
+                _write_value(value, out, by_alias, exclude_none, default)
+            # empty values are only known to be empty once they're converted, e.g. a model without any values
+            if exclude_empty and len(out) - value_start == 2 and out[value_start:] in _EMPTY_JSON:
+                del out[mark:]
+        if len(values) != len(self.field_names) or not values.keys() <= self.field_names:
+            for name, value in values.items():
+                if name in self.field_names or (value is None and (exclude_none or exclude_empty)):
+                    continue
+                mark = len(out)
+                if mark != start:
+                    out += b","
+                out += _json_key(name)
+                value_start = len(out)
+                _write_value(value, out, by_alias, exclude_none, default)
+                if exclude_empty and len(out) - value_start == 2 and out[value_start:] in _EMPTY_JSON:
+                    del out[mark:]
+        out += b"}"
+
+
+def _field_kind(field: ModelField) -> int:
+    if field.sub_fields is not None and field.shape == SHAPE_SINGLETON:
+        # a Union
+        return _VALUE
+    if lenient_issubclass(field.type_, pydantic.BaseModel):
+        if field.shape == SHAPE_SINGLETON:
+            return _MODEL
+        if field.shape in (SHAPE_LIST, SHAPE_SEQUENCE):
+            return _MODEL_SEQUENCE
+    return _VALUE
+
+
+_SERIALIZERS: Dict[type, Optional[_ModelSerializer]] = {}
+
+
+def _model_serializer(cls: type) -> Optional[_ModelSerializer]:
+    """The serializer of a model class, None for classes the compiled serializer doesn't support."""
+    try:
+        return _SERIALIZERS[cls]
+    except KeyError:
+        pass
+    serializer = None
+    if (
+        isinstance(cls, type)
+        and issubclass(cls, BaseModel)
+        and cls.dict is BaseModel.dict
+        and not cls.__custom_root_type__
+        and cls.__include_fields__ is None
+        and all(isinstance(exclude, bool) for exclude in (cls.__exclude_fields__ or {}).values())
+        and not getattr(cls.__config__, "use_enum_values", False)
+    ):
+        serializer = _ModelSerializer(cls)
+    _SERIALIZERS[cls] = serializer
+    return serializer
+
+
+def _model_to_dict(value: Any, by_alias: bool, exclude_none: bool) -> Any:
+    serializer = _SERIALIZERS.get(type(value)) or _model_serializer(type(value))
+    if serializer is None:
+        return _value_to_dict(value, by_alias, exclude_none)
+    # nested models always exclude empty values, like pydantic's dict() of a nested model calls our dict() with its defaults
+    return serializer.dict(value, by_alias, exclude_none, True)
+
+
+def _sequence_to_dict(value: Any, by_alias: bool, exclude_none: bool) -> Any:
+    if type(value) is not list:
+        return _value_to_dict(value, by_alias, exclude_none)
+    return [_model_to_dict(item, by_alias, exclude_none) for item in value]
+
+
+def _write_model(
+    value: Any, out: bytearray, by_alias: bool, exclude_none: bool, default: Callable[[Any], Any]
+) -> None:
+    serializer = _SERIALIZERS.get(type(value)) or _model_serializer(type(value))
+    if serializer is None:
+        _write_value(value, out, by_alias, exclude_none, default)
+    else:
+        serializer.write(value, out, by_alias, exclude_none, True, default)
+
+
+def _write_value(
+    value: Any, out: bytearray, by_alias: bool, exclude_none: bool, default: Callable[[Any], Any]
+) -> None:
+    """Write the JSON of a value like `json.dumps(_value_to_dict(value), default=default)` does, with compact separators and without escaping non-ASCII characters."""
+    if isinstance(value, str):
+        out += encode_basestring(value).encode()
+    elif value is None:
+        out += b"null"
+    elif value is True:
+        out += b"true"
+    elif value is False:
+        out += b"false"
+    elif isinstance(value, int):
+        out += int.__repr__(value).encode()
+    elif isinstance(value, float):
+        # NaN and Infinity like the json module writes them
+        out += (float.__repr__(value) if value - value == 0 else json.dumps(value)).encode()
+    elif isinstance(value, pydantic.BaseModel):
+        serializer = _model_serializer(type(value))
+        if serializer is not None:
+            serializer.write(value, out, by_alias, exclude_none, True, default)
+        else:
+            _write_value(_value_to_dict(value, by_alias, exclude_none), out, by_alias, exclude_none, default)
+    elif isinstance(value, dict):
+        out += b"{"
+        for i, (k, v) in enumerate(value.items()):
+            if i:
+                out += b","
+            out += _json_key(k if isinstance(k, str) else json.dumps(k))
+            _write_value(v, out, by_alias, exclude_none, default)
+        out += b"}"
+    elif sequence_like(value):
+        out += b"["
+        for i, item in enumerate(value):
+            if i:
+                out += b","
+            _write_value(item, out, by_alias, exclude_none, default)
+        out += b"]"
+    else:
+        _write_value(default(value), out, by_alias, exclude_none, default)
+
+
+def _value_to_dict(value: Any, by_alias: bool, exclude_none: bool) -> Any:
+    """pydantic's `BaseModel._get_value` with `to_dict=True`."""
+    if type(value) in _SCALARS:
+        return value
+    if isinstance(value, pydantic.BaseModel):
+        serializer = _model_serializer(type(value))
+        if serializer is not None:
+            return serializer.dict(value, by_alias, exclude_none, True)
+        data = value.dict(by_alias=by_alias, exclude_none=exclude_none)
+        return data[ROOT_KEY] if ROOT_KEY in data else data
+    if isinstance(value, dict):
+        return {
+            k: _value_to_dict(v, by_alias, exclude_none) for k, v in value.items()
+        }
+    if sequence_like(value):
+        items = [_value_to_dict(v, by_alias, exclude_none) for v in value]
+        if is_namedtuple(value.__class__):
+            return value.__class__(*items)
+        return value.__class__(items)
+    return value
+
 
 class BaseModel(pydantic.BaseModel):
     def __hash__(self):
@@ -38,6 +327,7 @@ class BaseModel(pydantic.BaseModel):
         exclude_none: bool = False,
         exclude_empty: bool = True,
     ) -> Generator[Tuple[str, Any], None, None]:
+        choices = _choice_fields(type(self)) if by_alias else {}
         for k, v in super()._iter(
             to_dict,
             by_alias,
@@ -55,9 +345,28 @@ class BaseModel(pydantic.BaseModel):
                         continue
                 except TypeError:
                     pass
-                
+            if k in choices and v is not None:
+                k = choices[k][type(getattr(self, k))]
             yield k, v
 
+    def _compiled_dict(
+        self,
+        include: Union[AbstractSetIntStr, MappingIntStrAny],
+        exclude: Union[AbstractSetIntStr, MappingIntStrAny],
+        by_alias: bool,
+        exclude_unset: bool,
+        exclude_defaults: bool,
+        exclude_none: bool,
+        exclude_empty: bool,
+    ) -> Optional[DictStrAny]:
+        """The dict of the model from the serializer that is compiled once per model class, None when the options or the model need pydantic's `_iter`."""
+        if include is not None or exclude is not None or exclude_unset or exclude_defaults:
+            return None
+        serializer = _model_serializer(type(self))
+        if serializer is None:
+            return None
+        return serializer.dict(self, by_alias, exclude_none, exclude_empty)
+
     def dict(
         self,
         *,
@@ -80,6 +389,11 @@ class BaseModel(pydantic.BaseModel):
                 DeprecationWarning,
             )
             exclude_unset = skip_defaults
+        data = self._compiled_dict(
+            include, exclude, by_alias, exclude_unset, exclude_defaults, exclude_none, exclude_empty
+        )
+        if data is not None:
+            return data
         return dict(
             self._iter(
                 to_dict=True,
@@ -93,6 +407,28 @@ class BaseModel(pydantic.BaseModel):
             )
         )
 
+    def json_bytes(
+        self,
+        *,
+        by_alias: bool = True,
+        exclude_none: bool = True,
+        exclude_empty: bool = True,
+        encoder: Optional[Callable[[Any], Any]] = None,
+    ) -> bytes:
+        """The FHIR JSON of the model as UTF-8 bytes, like `json` returns it but written straight into a buffer while walking the model, without building a dict first.
+        The JSON is compact and non-ASCII characters aren't escaped."""
+        encoder = cast(Callable[[Any], Any], encoder or self.__json_encoder__)
+        serializer = _model_serializer(type(self))
+        out = bytearray()
+        if serializer is None:
+            data = self.dict(by_alias=by_alias, exclude_none=exclude_none, exclude_empty=exclude_empty)
+            if self.__custom_root_type__:
+                data = data[ROOT_KEY]
+            _write_value(data, out, by_alias, exclude_none, encoder)
+        else:
+            serializer.write(self, out, by_alias, exclude_none, exclude_empty, encoder)
+        return bytes(out)
+
     def json(
         self,
         *,
@@ -112,18 +448,27 @@ class BaseModel(pydantic.BaseModel):
         # We don't directly call `self.dict()`, which does exactly this with `to_dict=True`
         # because we want to be able to keep raw `BaseModel` instances and not as `dict`.
         # This allows users to write custom JSON encoders for given `BaseModel` classes.
-        data = dict(
-            self._iter(
-                to_dict=models_as_dict,
-                by_alias=by_alias,
-                include=include,
-                exclude=exclude,
-                exclude_unset=exclude_unset,
-                exclude_defaults=exclude_defaults,
-                exclude_none=exclude_none,
-                exclude_empty=exclude_empty,
+        data = None
+        if models_as_dict:
+            data = self._compiled_dict(
+                include, exclude, by_alias, exclude_unset, exclude_defaults, exclude_none, exclude_empty
+            )
+        if data is None:
+            data = dict(
+                self._iter(
+                    to_dict=models_as_dict,
+                    by_alias=by_alias,
+                    include=include,
+                    exclude=exclude,
+                    exclude_unset=exclude_unset,
+                    exclude_defaults=exclude_defaults,
+                    exclude_none=exclude_none,
+                    exclude_empty=exclude_empty,
+                )
             )
-        )
         if self.__custom_root_type__:
             data = data[ROOT_KEY]
+        # the configured JSON backend only replaces the default encoder without extra options (e.g. indent)
+        if self.__config__.json_dumps is json.dumps and not dumps_kwargs:
+            return json_dumps(data, default=encoder)
         return self.__config__.json_dumps(data, default=encoder, **dumps_kwargs)
@@ -1,4 +1,7 @@
-from typing import List, Optional, Sequence
+from json.encoder import encode_basestring
+from types import TracebackType
+from typing import IO, Any, Iterable, List, Optional, Sequence, Type
+from uuid import UUID
 
 
 try:
@@ -33,7 +36,7 @@ class BundleSearchScore(ConstrainedFloat):
 
 class BundleSearch(BackboneElement):
     mode: Optional[BundleSearchMode]
-    score: BundleSearchScore
+    score: Optional[BundleSearchScore]
 
 
 class BundleLink(BackboneElement):
@@ -61,15 +64,115 @@ class BundleResponse(BackboneElement):
 class BundleEntry(BackboneElement):
     fullUrl: Optional[URI]
     resource: Optional[Resource]
+    search: Optional[BundleSearch]
     request: Optional[BundleRequest]
     response: Optional[BundleResponse]
 
 
 class Bundle(Resource):
-    resourceType = Field("Bundle", const=True)
+    resourceType: Literal["Bundle"] = Field("Bundle", const=True)
     identifier: Optional[Identifier] = None
     type: BundleType
     timestamp: Optional[Instant] = None
     link: Sequence[BundleLink] = []
-    entry: List[BundleEntry]
+    entry: List[BundleEntry] = []
     signature: Optional[Signature] = None
+
+
+class BundleWriter:
+    """Streams a Bundle JSON document entry by entry to a binary file object (e.g. an opened file or `socket.makefile("wb")`),
+    so memory use doesn't depend on the number of entries:
+
+        with open("bundle.json", "wb") as f, BundleWriter(f, "collection", base_url="http://example.org/fhir") as writer:
+            writer.write_all(store.iter())
+
+    The fullUrl of an entry is `<base_url>/<resourceType>/<id>`, or `urn:uuid:<id>` without `base_url` for ids that are UUIDs.
+    The other fields of the Bundle (e.g. `id`, `timestamp` or `link`) are passed as keyword arguments.
+    Entries of a searchset get `search.mode` "match" and the Bundle its `total`, the number of "match" entries, unless they are given.
+    """
+
+    def __init__(
+        self,
+        fp: IO[bytes],
+        type: BundleType = "collection",
+        base_url: Optional[str] = None,
+        **fields: Any,
+    ) -> None:
+        self.fp = fp
+        self.type = type
+        self.base_url = base_url.rstrip("/") if base_url is not None else None
+        self.n_entries = 0
+        # entries with search.mode "match", the total of a searchset doesn't count included resources
+        self.n_matches = 0
+        self._total = fields.pop("total", None)
+        self._closed = False
+        header = Bundle.construct(type=type, **fields).json_bytes()
+        # leave the object open for the entries
+        fp.write(header[:-1])
+
+    def full_url(self, resource: Resource) -> Optional[str]:
+        if resource.id is None:
+            return None
+        if self.base_url is not None:
+            return f"{self.base_url}/{resource.resourceType}/{resource.id}"
+        try:
+            return UUID(resource.id).urn
+        except ValueError:
+            return None
+
+    def write(self, resource: Resource, full_url: Optional[str] = None, **entry_fields: Any) -> None:
+        """Write an entry with `resource`, the other fields of the BundleEntry (e.g. `request`) are passed as keyword arguments."""
+        if self._closed:
+            raise ValueError("The Bundle is closed already.")
+        mode = None
+        if self.type == "searchset":
+            search = entry_fields.setdefault("search", {"mode": "match"})
+            mode = search.get("mode") if isinstance(search, dict) else getattr(search, "mode", None)
+        if full_url is None:
+            full_url = self.full_url(resource)
+        entry = bytearray(b',"entry":[{' if self.n_entries == 0 else b",{")
+        if full_url is not None:
+            entry += b'"fullUrl":' + encode_basestring(full_url).encode() + b","
+        entry += b'"resource":' + resource.json_bytes()
+        if entry_fields:
+            fields = BundleEntry.construct(**entry_fields).json_bytes()
+            if fields != b"{}":
+                entry += b"," + fields[1:-1]
+        entry += b"}"
+        self.fp.write(entry)
+        self.n_entries += 1
+        if mode == "match":
+            self.n_matches += 1
+
+    def write_all(self, resources: Iterable[Resource]) -> int:
+        """Write an entry for every resource. Returns the number of entries that were written."""
+        n_entries = self.n_entries
+        for resource in resources:
+            self.write(resource)
+        return self.n_entries - n_entries
+
+    def close(self) -> None:
+        """Finish the Bundle document. The file object isn't closed."""
+        if self._closed:
+            return
+        end = b"]" if self.n_entries else b""
+        total = self._total
+        if total is None and self.type == "searchset":
+            total = self.n_matches
+        if total is not None:
+            end += b',"total":%d' % total
+        self.fp.write(end + b"}")
+        self._closed = True
+
+    def __enter__(self) -> "BundleWriter":
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc: Optional[BaseException],
+        traceback: Optional[TracebackType],
+    ) -> None:
+        # an incomplete document is left as is when writing failed
+        if exc_type is None:
+            self.close()
@@ -0,0 +1,158 @@
+from typing import Any, Dict, Optional, Tuple, Type, Union
+
+from pydantic import BaseModel, ValidationError
+from pydantic.error_wrappers import ErrorWrapper
+from pydantic.utils import ROOT_KEY
+
+from fhirkit.elements import Identifier, Reference
+from fhirkit.json_backend import json_dumps_bytes, json_loads
+from fhirkit.Resource import RESOURCE_MODELS_BY_TYPE, Resource
+from fhirkit.parse import parse_obj_as_resource
+
+RawResource = Union[str, bytes, Dict[str, Any]]
+# the fields whose reference puts a resource in the compartment of a patient
+PATIENT_REFERENCE_FIELDS = ("subject", "patient")
+
+
+class LazyResource:
+    """Proxy for a resource that is kept as raw JSON (or a decoded dict) and only validated into its model when one of its other fields is accessed.
+
+    `resourceType`, `id`, `identifier` and the `subject` and `patient` references are extracted up front,
+    so a store can look up the resource and its patient without validating it.
+    `isinstance` checks are answered with the model registered for the resourceType, e.g. `isinstance(LazyResource(raw), Observation)`.
+    """
+
+    __slots__ = ("resourceType", "id", "identifier", "_patient_references", "_raw", "_resource")
+
+    def __init__(self, raw: RawResource) -> None:
+        if isinstance(raw, dict):
+            obj = raw
+        else:
+            try:
+                obj = json_loads(raw)
+            except ValueError as exc:
+                raise ValidationError([ErrorWrapper(exc, loc=ROOT_KEY)], Resource)
+        # resolving the model validates the resourceType like parse_obj_as_resource does
+        resource_type = obj.get("resourceType") if isinstance(obj, dict) else None
+        if not isinstance(resource_type, str) or resource_type not in RESOURCE_MODELS_BY_TYPE:
+            parse_obj_as_resource(obj)
+        object.__setattr__(self, "resourceType", resource_type)
+        object.__setattr__(self, "id", obj.get("id"))
+        identifier = obj.get("identifier")
+        # most resources have a list of identifiers, some (e.g. Bundle) a single one
+        if isinstance(identifier, dict):
+            identifier = Identifier.parse_obj(identifier)
+        else:
+            identifier = [Identifier.parse_obj(i) for i in identifier or []]
+        object.__setattr__(self, "identifier", identifier)
+        object.__setattr__(
+            self,
+            "_patient_references",
+            tuple(
+                (value.get("reference"), value.get("type"))
+                for value in map(obj.get, PATIENT_REFERENCE_FIELDS)
+                if isinstance(value, dict)
+            ),
+        )
+        object.__setattr__(self, "_raw", raw)
+        object.__setattr__(self, "_resource", None)
+
+    @property  # type: ignore
+    def __class__(self) -> Type[Resource]:
+        return RESOURCE_MODELS_BY_TYPE[self.resourceType]
+
+    @property
+    def is_materialized(self) -> bool:
+        return self._resource is not None
+
+    def materialize(self) -> Resource:
+        """Validate the raw JSON into its resource model. The raw JSON is released afterwards."""
+        if self._resource is None:
+            raw = self._raw
+            resource = parse_obj_as_resource(
+                raw if isinstance(raw, dict) else json_loads(raw)
+            )
+            # keep changes that were made to the proxy before it was materialized
+            if resource.id != self.id:
+                resource.id = self.id
+            object.__setattr__(self, "_resource", resource)
+            object.__setattr__(self, "_raw", None)
+        return self._resource
+
+    def patient_references(self) -> Tuple[Tuple[Optional[str], Optional[str]], ...]:
+        """The `(reference, type)` of the `subject` and `patient` references, without validating the resource."""
+        if self._resource is None:
+            return self._patient_references
+        values = (getattr(self._resource, name, None) for name in PATIENT_REFERENCE_FIELDS)
+        return tuple((v.reference, v.type) for v in values if isinstance(v, Reference))
+
+    def raw_field(self, name: str) -> Any:
+        """The JSON value of a field (e.g. a reference as a dict) without validating the resource."""
+        if self._resource is not None:
+            value = getattr(self._resource, name, None)
+            return value.dict() if isinstance(value, BaseModel) else value
+        raw = self._raw
+        obj = raw if isinstance(raw, dict) else json_loads(raw)
+        return obj.get(name)
+
+    def __getattr__(self, name: str) -> Any:
+        # only called for attributes that aren't extracted up front
+        if name.startswith("__"):
+            # pydantic's isinstance check looks for class level data like __post_root_validators__
+            value = getattr(self.__class__, name)
+            if callable(value):
+                raise AttributeError(name)
+            return value
+        return getattr(self.materialize(), name)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        if name == "id":
+            object.__setattr__(self, name, value)
+            if self._resource is None:
+                return
+        resource = self.materialize()
+        setattr(resource, name, value)
+        if name == "identifier":
+            # the proxy keeps answering lookups by identifier
+            object.__setattr__(self, name, resource.identifier)
+
+    def json_bytes(self, **kwargs: Any) -> bytes:
+        """The JSON of the resource like `BaseModel.json_bytes`. Without options a proxy that isn't materialized is written from its raw JSON, without validating it."""
+        if self._resource is not None or kwargs:
+            return self.materialize().json_bytes(**kwargs)
+        raw = self._raw
+        obj = raw if isinstance(raw, dict) else json_loads(raw)
+        # the id of the proxy can be changed before it's materialized
+        if obj.get("id") != self.id:
+            obj = {**obj, "id": self.id}
+        return json_dumps_bytes(obj)
+
+    def __reduce__(self):
+        if self._resource is not None:
+            return self._resource.__reduce__()
+        return _restore_lazy_resource, (self._raw, self.id)
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, LazyResource):
+            other = other.materialize()
+        return self.materialize() == other
+
+    def __hash__(self) -> int:
+        return hash(self.materialize())
+
+    def __str__(self) -> str:
+        text = self.resourceType
+        if self.id:
+            text += f"/{self.id}"
+        return text
+
+    def __repr__(self) -> str:
+        if self._resource is not None:
+            return repr(self._resource)
+        return f"{type(self).__name__}({self})"
+
+
+def _restore_lazy_resource(raw: RawResource, id: Optional[str]) -> LazyResource:
+    resource = LazyResource(raw)
+    resource.id = id
+    return resource
@@ -16,6 +16,7 @@ from typing import (
     Optional,
     Sequence,
     Tuple,
+    Type,
     Union,
     Generator,
 )
@@ -43,6 +44,7 @@ AbstractSetIntStr = AbstractSet[Union[int, str]]
 MappingIntStrAny = Mapping[Union[int, str], Any]
 
 RESOURCE_MODELS = []
+RESOURCE_MODELS_BY_TYPE: Dict[str, Type[Resource]] = {}
 
 class Resource(BaseModel):
 
@@ -54,6 +56,11 @@ class Resource(BaseModel):
 
     def __init_subclass__(cls) -> None:
         RESOURCE_MODELS.append(cls)
+        # abstract models (e.g. DomainResource) have no fixed resourceType and
+        # specialisations (e.g. SimpleValueSet) don't replace the model they derive from
+        resource_type = cls.__fields__["resourceType"].default
+        if isinstance(resource_type, str):
+            RESOURCE_MODELS_BY_TYPE.setdefault(resource_type, cls)
 
     def __str__(self) -> str:
         text = self.resourceType
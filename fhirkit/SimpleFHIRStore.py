@@ -1,20 +1,46 @@
+from array import array
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from bisect import bisect_left, insort
+from copy import deepcopy
+from functools import partial
+import hashlib
+from itertools import islice
 import logging
+import os
 from pathlib import Path
+import pickle
+import re
 import resource
+import tempfile
+import time
+import weakref
 from typing import (
+    AbstractSet,
+    Any,
     Callable,
+    Collection,
+    Deque,
+    Dict,
     Generator,
     Generic,
+    Hashable,
+    IO,
+    Iterable,
     List,
+    NamedTuple,
     Optional,
     Sequence,
+    Set,
+    Tuple,
     TypeVar,
     Union,
 )
 from uuid import uuid5, uuid4
 
-from pydantic import HttpUrl, ValidationError, parse_file_as, parse_obj_as
-from fhirkit.elements.elements import CodeableConcept, Coding, Reference, Identifier
+from pydantic import HttpUrl, ValidationError, parse_obj_as
+from fhirkit.elements.elements import CodeableConcept, Coding, Reference, Identifier, Meta
 from fhirkit.primitive_datatypes import (
     URI,
     AbsoluteURL,
@@ -24,15 +50,52 @@ from fhirkit.primitive_datatypes import (
     canonical,
     literal,
 )
-from fhirkit.Bundle import Bundle
+from fhirkit.Bundle import Bundle, BundleEntry
 from fhirkit.Server import AbstractFHIRServer, ResourceNotFoundError
 from fhirkit.TerminologyServer import AbstractFHIRTerminologyServer
-from fhirkit.Resource import Resource, ResourceWithMultiIdentifier
-from fhirkit.parse import AnyPatientResource, parse_json_as_resource
+from fhirkit.ValueSet import ValueSet
+from fhirkit.Resource import CanonicalResource, Resource
+from fhirkit.json_backend import get_json_backend, json_loads, set_json_backend
+from fhirkit.parse import parse_obj_as_resource
+from fhirkit.cohort import Cohort, PatientCohort, bitmap_from_positions
+from fhirkit.search import (
+    MIN_DATETIME,
+    URN_UUID_PREFIX,
+    DateIndex,
+    Interval,
+    SearchParameter,
+    Token,
+    extract_intervals,
+    extract_keys,
+    extract_tokens,
+    get_search_parameter,
+    parse_date_interval,
+    parse_date_search,
+    parse_reference,
+    parse_token,
+    patient_compartment,
+    split_values,
+    valueset_tokens,
+)
+from fhirkit.ndjson import (
+    DEFAULT_CHUNK_SIZE,
+    DEFAULT_EXPORT_CHUNK_SIZE,
+    complete_lines_end,
+    ndjson_line,
+    open_ndjson_writer,
+    parse_ndjson_chunk,
+    parse_ndjson_lines,
+    serialize_ndjson_chunk,
+    skip_ndjson_file,
+    split_ndjson,
+)
 from tqdm import tqdm
 
 LOGGER = logging.getLogger(__name__)
 R = TypeVar("R", bound=Resource)
+SNAPSHOT_MAGIC = b"FHIRKIT-SNAPSHOT-3\n"
+FINGERPRINT_SIZE = 4096
+VERSION_PART_PATTERN = re.compile(r"(\d+)")
 
 
 def traverse(
@@ -53,6 +116,132 @@ def traverse(
                 yield childPath
 
 
+def _ndjson_paths(
+    path: Path, resource_types: Optional[AbstractSet[str]] = None
+) -> Generator[Path, None, None]:
+    """Find the NDJSON files in a bulk export directory, skipping files that are named after other resource types."""
+    return traverse(
+        path,
+        lambda p: p.suffix == ".ndjson" and not skip_ndjson_file(p, resource_types),
+    )
+
+
+def _search_interval(value: Union[datetime, str]) -> Interval:
+    if isinstance(value, str):
+        return parse_date_interval(value)
+    value = value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value
+    return value, value
+
+
+def version_key(version: Optional[str]) -> Tuple:
+    """Sort key that orders versions naturally, so "1.10.0" comes after "1.9.2". Resources without a version come first."""
+    if version is None:
+        return ()
+    # numeric parts are compared as numbers, the flag keeps numbers and text comparable
+    return tuple(
+        (1, int(part), "") if part.isdigit() else (0, 0, part)
+        for part in VERSION_PART_PATTERN.split(version)
+        if part
+    )
+
+
+def _source_manifest(
+    path: Path, suffix: str, **options: Any
+) -> Dict[str, Any]:
+    """Describe the files with `suffix` in a directory by their size and modification time, together with the options they were loaded with."""
+    files: Dict[str, Tuple[int, int]] = {}
+    for fpath in traverse(path, lambda p: p.suffix == suffix):
+        stat = fpath.stat()
+        files[str(fpath.absolute())] = (stat.st_size, stat.st_mtime_ns)
+    return {
+        "root": str(path.absolute()),
+        "suffix": suffix,
+        "files": files,
+        "options": options,
+    }
+
+
+class SnapshotOutdatedError(Exception):
+    pass
+
+
+class IngestedFile(NamedTuple):
+    """How much of an NDJSON file has been loaded into a store."""
+
+    size: int
+    mtime_ns: int
+    n_lines: int
+    # hash of the bytes right before `size`, to recognise a file that was appended to
+    fingerprint: bytes
+
+
+class IndexedKeys:
+    """The keys a resource was indexed with. A resource is removed from the indexes with these keys,
+    so a resource that was changed in place (e.g. get, change and put again) doesn't leave stale keys behind."""
+
+    __slots__ = ("resourceType", "id", "compartment", "identifiers", "canonical", "derived")
+
+    def __init__(
+        self,
+        resourceType: str,
+        id: Optional[str],
+        compartment: Tuple[str, ...],
+        identifiers: Tuple[Tuple[str, Optional[str], str], ...],
+        canonical: Optional[Tuple[str, Optional[str]]],
+    ) -> None:
+        self.resourceType = resourceType
+        self.id = id
+        self.compartment = compartment
+        self.identifiers = identifiers
+        self.canonical = canonical
+        # keys of the search indexes that are built on first use, by ("search", parameter), ("token", path) or ("date", path)
+        self.derived: Optional[Dict[Tuple[str, str], Tuple]] = None
+
+    def add_derived(self, kind: str, name: str, keys: Iterable) -> Tuple:
+        keys = tuple(keys)
+        if self.derived is None:
+            self.derived = {}
+        self.derived[(kind, name)] = keys
+        return keys
+
+    def get_derived(self, kind: str, name: str) -> Tuple:
+        return self.derived.get((kind, name), ()) if self.derived is not None else ()
+
+
+def _fingerprint(path: Path, size: int) -> bytes:
+    with open(path, "rb") as f:
+        f.seek(max(size - FINGERPRINT_SIZE, 0))
+        return hashlib.blake2b(f.read(min(size, FINGERPRINT_SIZE))).digest()
+
+
+def iter_bulk_export(
+    path: Union[str, Path],
+    resource_types: Optional[Collection[str]] = None,
+    predicate: Optional[Callable[[Resource], bool]] = None,
+    lazy: bool = False,
+) -> Generator[Resource, None, None]:
+    """Iterate over the resources in a directory with NDJSON files as if they are exported from the FHIR Bulk export API.
+    Resources are parsed and yielded one at a time, so memory usage doesn't grow with the size of the export.
+    Only resources with a resourceType in `resource_types` and for which `predicate` returns True are yielded.
+    With `lazy` a `LazyResource` is yielded that is only validated when its fields are accessed."""
+    if isinstance(path, str):
+        path = Path(path)
+    if resource_types is not None:
+        resource_types = frozenset(resource_types)
+    for fpath in _ndjson_paths(path, resource_types):
+        with open(fpath, "r") as f:
+            for i, resource in parse_ndjson_lines(f, resource_types, lazy):
+                if isinstance(resource, ValidationError):
+                    LOGGER.warning(
+                        "Couldn't parse line %d from '%s'",
+                        i,
+                        str(fpath.absolute()),
+                        exc_info=resource,
+                    )
+                elif resource is not None and (predicate is None or predicate(resource)):
+                    yield resource
+
+
 class SimpleFHIRStore(Generic[R], AbstractFHIRTerminologyServer, AbstractFHIRServer):
     """Simple FHIR Server holds a list of resources in memory. It can be initialised based on bulk export directory."""
 
@@ -61,51 +250,281 @@ class SimpleFHIRStore(Generic[R], AbstractFHIRTerminologyServer, AbstractFHIRSer
         resources: Sequence[R] = [],
         references: Sequence[Reference] = [],
         base_url: Optional[Union[str, HttpUrl]] = None,
+        history: int = 0,
     ) -> None:
         self.resources = []
-        self._resources = list(resources)
+        # deleted resources leave a None behind, so the positions of the other resources don't change
+        self._resources: List[Optional[R]] = list(resources)
+        self._n_deleted = 0
+        # positions that were replaced, added or deleted after the store was created, views use it to update their positions.
+        # The changes that every view has seen are dropped from the front, `_changes_offset` counts them
+        self._changed_positions: List[int] = []
+        self._changes_offset = 0
+        self._views: "weakref.WeakSet[SimpleFHIRStoreView[R]]" = weakref.WeakSet()
         self._references = list(references)
+        # positions of the resources in self._resources by (resourceType, id)
+        self._id_index: Dict[Tuple[str, str], int] = {}
+        # positions by (resourceType, identifier.system, identifier.value)
+        self._identifier_index: Dict[Tuple[str, Optional[str], str], int] = {}
+        # the other positions with an id or identifier key, sorted, one of them takes over when the indexed resource goes
+        self._duplicate_positions: Dict[Hashable, List[int]] = {}
+        # positions of canonical resources by url and (url, version), the versions of an url are sorted by version_key
+        self._canonical_index: Dict[str, List[Tuple[Tuple, int]]] = {}
+        self._canonical_version_index: Dict[Tuple[str, str], int] = {}
+        self._type_index: Dict[str, Set[int]] = {}
+        # search indexes are built on first use: reference parameters by resourceType and parameter name,
+        # (system, code) tokens by resourceType and field
+        self._search_indexes: Dict[str, Dict[str, Dict[Hashable, Set[int]]]] = {}
+        self._token_indexes: Dict[str, Dict[str, Dict[Token, Set[int]]]] = {}
+        # intervals by resourceType and field, sorted for range queries
+        self._date_indexes: Dict[str, Dict[str, DateIndex]] = {}
+        # positions of the resources in the compartment of every patient id
+        self._compartment_index: Dict[str, Set[int]] = {}
+        # positions of the resources with a urn:uuid patient reference by the uuid, until a Patient with that id is indexed
+        self._unresolved_compartments: Dict[str, Set[int]] = {}
+        # the keys every position was indexed with, None for deleted resources
+        self._index_keys: List[Optional[IndexedKeys]] = []
+        # patients are numbered in order of appearance for the bitmaps of patient cohorts
+        self._patient_numbers: Dict[str, int] = {}
+        self._patient_ids: List[str] = []
+        # the files the store was loaded from, used to invalidate snapshots
+        self._sources: Optional[Dict[str, Any]] = None
+        # the NDJSON files that were loaded, used to only parse new data on sync
+        self._ingested: Dict[str, IngestedFile] = {}
+        # the previous versions of updated and deleted resources by (resourceType, id), newest last
+        self._history_size = history
+        self._history: Dict[Tuple[str, str], Deque[R]] = {}
+        # copies of the resources as they were put, the previous version of a resource that is changed in place and put again
+        self._put_versions: Dict[Tuple[str, str], R] = {}
+        # the last version of deleted resources, a resource that is created again continues from it
+        self._deleted_versions: Dict[Tuple[str, str], int] = {}
+        for position in range(len(self._resources)):
+            self._index_resource(position)
         super().__init__(base_url)
 
+    @staticmethod
+    def _identifiers(resource: R) -> Sequence[Identifier]:
+        # not every resource with identifiers is a ResourceWithMultiIdentifier (e.g. Patient) and some have a single one
+        identifiers = getattr(resource, "identifier", None)
+        if isinstance(identifiers, Identifier):
+            return [identifiers]
+        return identifiers or []
+
+    @classmethod
+    def _identifier_keys(
+        cls, resource: R
+    ) -> Generator[Tuple[str, Optional[str], str], None, None]:
+        for identifier in cls._identifiers(resource):
+            if identifier.value is not None:
+                yield resource.resourceType, identifier.system, identifier.value
+
+    def _index_resource(self, position: int) -> None:
+        resource = self._resources[position]
+        resource_type = resource.resourceType
+        canonical = None
+        if isinstance(resource, CanonicalResource) and resource.url is not None:
+            canonical = (str(resource.url), resource.version)
+        keys = IndexedKeys(
+            resource_type,
+            resource.id,
+            tuple(self._resolve_compartment(patient_compartment(resource))),
+            tuple(self._identifier_keys(resource)),
+            canonical,
+        )
+        if position == len(self._index_keys):
+            self._index_keys.append(keys)
+        else:
+            self._index_keys[position] = keys
+        self._type_index.setdefault(resource_type, set()).add(position)
+        for patient_id in keys.compartment:
+            if patient_id.startswith(URN_UUID_PREFIX):
+                self._unresolved_compartments.setdefault(patient_id[len(URN_UUID_PREFIX) :], set()).add(position)
+            else:
+                self._add_to_compartment(patient_id, position)
+        for name, index in self._search_indexes.get(resource_type, {}).items():
+            parameter = get_search_parameter(resource_type, name)
+            for key in keys.add_derived("search", name, extract_keys(parameter, resource)):
+                index.setdefault(key, set()).add(position)
+        for path, token_index in self._token_indexes.get(resource_type, {}).items():
+            for token in keys.add_derived("token", path, extract_tokens(resource, path)):
+                token_index.setdefault(token, set()).add(position)
+        for path, date_index in self._date_indexes.get(resource_type, {}).items():
+            date_index.add(position, keys.add_derived("date", path, extract_intervals(resource, path)))
+        # the first resource with a key wins, like a scan over the resources would
+        if keys.id is not None:
+            self._add_unique_key(self._id_index, (resource_type, keys.id), position)
+        for key in keys.identifiers:
+            self._add_unique_key(self._identifier_index, key, position)
+        if canonical is not None:
+            url, version = canonical
+            # the negated position makes the first of equal versions sort last, so it's the one returned as latest
+            insort(
+                self._canonical_index.setdefault(url, []),
+                (version_key(version), -position),
+            )
+            if version is not None:
+                self._canonical_version_index.setdefault((url, version), position)
+        if resource_type == "Patient" and keys.id in self._unresolved_compartments:
+            # resources that were indexed before the Patient they refer to by urn:uuid
+            for resolved in self._unresolved_compartments.pop(keys.id):
+                resolved_keys = self._index_keys[resolved]
+                resolved_keys.compartment = tuple(self._resolve_compartment(resolved_keys.compartment))
+                self._add_to_compartment(keys.id, resolved)
+
+    def _add_unique_key(self, index: Dict[Any, int], key: Hashable, position: int) -> None:
+        indexed = index.setdefault(key, position)
+        if indexed == position:
+            return
+        if position < indexed:
+            # a replaced resource can come before the one that is indexed
+            index[key], position = position, indexed
+        insort(self._duplicate_positions.setdefault(key, []), position)
+
+    def _remove_unique_key(self, index: Dict[Any, int], key: Hashable, position: int) -> None:
+        duplicates = self._duplicate_positions.get(key)
+        if index.get(key) == position:
+            if duplicates:
+                index[key] = duplicates.pop(0)
+            else:
+                del index[key]
+        elif duplicates is not None and position in duplicates:
+            duplicates.remove(position)
+        if duplicates is not None and not duplicates:
+            del self._duplicate_positions[key]
+
+    def _resolve_compartment(self, patient_ids: Iterable[str]) -> Generator[str, None, None]:
+        """Replace the urn:uuid patient references of a compartment by the id of the Patient with that uuid as id, like Synthea bundles refer to their patient."""
+        for patient_id in patient_ids:
+            if patient_id.startswith(URN_UUID_PREFIX):
+                uuid = patient_id[len(URN_UUID_PREFIX) :]
+                if ("Patient", uuid) in self._id_index:
+                    patient_id = uuid
+            yield patient_id
+
+    def _add_to_compartment(self, patient_id: str, position: int) -> None:
+        self._compartment_index.setdefault(patient_id, set()).add(position)
+        if patient_id not in self._patient_numbers:
+            self._patient_numbers[patient_id] = len(self._patient_ids)
+            self._patient_ids.append(patient_id)
+
+    def _unindex_resource(self, position: int) -> None:
+        keys = self._index_keys[position]
+        self._index_keys[position] = None
+        resource_type = keys.resourceType
+        self._type_index[resource_type].discard(position)
+        for patient_id in keys.compartment:
+            if patient_id.startswith(URN_UUID_PREFIX):
+                self._unresolved_compartments[patient_id[len(URN_UUID_PREFIX) :]].discard(position)
+            else:
+                self._compartment_index[patient_id].discard(position)
+        for name, index in self._search_indexes.get(resource_type, {}).items():
+            for key in keys.get_derived("search", name):
+                index[key].discard(position)
+        for path, token_index in self._token_indexes.get(resource_type, {}).items():
+            for token in keys.get_derived("token", path):
+                token_index[token].discard(position)
+        for path, date_index in self._date_indexes.get(resource_type, {}).items():
+            date_index.remove(position, keys.get_derived("date", path))
+        if keys.id is not None:
+            self._remove_unique_key(self._id_index, (resource_type, keys.id), position)
+        for key in keys.identifiers:
+            self._remove_unique_key(self._identifier_index, key, position)
+        if keys.canonical is not None:
+            url, version = keys.canonical
+            versions = self._canonical_index[url]
+            versions.remove((version_key(version), -position))
+            if not versions:
+                del self._canonical_index[url]
+            if self._canonical_version_index.get((url, version)) == position:
+                del self._canonical_version_index[(url, version)]
+
+    def _replace_resource(self, position: int, resource: R) -> None:
+        self._unindex_resource(position)
+        self._resources[position] = resource
+        self._index_resource(position)
+        self._record_change(position)
+
+    def _append_resource(self, resource: R) -> int:
+        position = len(self._resources)
+        self._resources.append(resource)
+        self._index_resource(position)
+        self._record_change(position)
+        return position
+
+    def _record_change(self, position: int) -> None:
+        changes = self._changed_positions
+        changes.append(position)
+        if len(changes) >= max(len(self._resources), 1024):
+            # drop the changes that every view has seen, the views that are gone don't hold them back
+            n_changes = self._changes_offset + len(changes)
+            n_seen = min((view._n_changes for view in self._views), default=n_changes)
+            del changes[: n_seen - self._changes_offset]
+            self._changes_offset = n_seen
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # views aren't part of a snapshot, nor are the changes they would have to catch up on
+        state = self.__dict__.copy()
+        state["_views"] = None
+        state["_changes_offset"] += len(state["_changed_positions"])
+        state["_changed_positions"] = []
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self._views = weakref.WeakSet()
+
     def iter(self):
         """Dummy method because we can't expect all child classes to be iterable."""
-        yield from self._resources
+        for resource in self._resources:
+            if resource is not None:
+                yield resource
 
     def __iter__(self):
         return self.iter()
 
     def __len__(self):
-        return len(self._resources)
+        return len(self._resources) - self._n_deleted
+
+    def _contains_position(self, position: int) -> bool:
+        """Whether the resource at `position` of the underlying storage is part of this store, views on a store only contain some of them."""
+        return self._resources[position] is not None
+
+    def _resources_at(self, positions: Iterable[int]) -> List[R]:
+        return [
+            self._resources[position]
+            for position in sorted(positions)
+            if self._contains_position(position)
+        ]
 
     def get_resource_by_canonical(self, reference: Union[canonical, str]) -> "Resource":
+        """Resolve a canonical reference to the CanonicalResource with that url and version.
+        Without a version the latest version is returned, versions are compared with `version_key`."""
         reference = parse_obj_as(canonical, reference)
         version = reference.version
-        uri = reference.uri
-        for r in self._resources:
-            # skip resources that don't have url field or url doesn't match
-
-            # AVR 20221025 hasattr and getattr is not a good practice, we should use structural typing with
-            # a CanonicalResource as defined in https://build.fhir.org/canonicalresource.html and
-            # use runtime typechecking with a CanonicaResource protocol
-            if not hasattr(r, "url") or getattr(r, "url") != uri:
-                continue
-
-            if version is not None:
-
-                # skip resources that don't have a version field or the version doesn't match
-                if not hasattr(r, "version") or getattr(r, "version") != version:
-                    continue
-
-            return r
+        uri = str(reference.uri)
+        if version is not None:
+            position = self._canonical_version_index.get((uri, version))
+        else:
+            # the latest version that is part of this store
+            position = next(
+                (
+                    -negated
+                    for _, negated in reversed(self._canonical_index.get(uri, ()))
+                    if self._contains_position(-negated)
+                ),
+                None,
+            )
+        if position is not None and self._contains_position(position):
+            return self._resources[position]
 
         raise ResourceNotFoundError(f"Couldn't resolve canonical reference {reference}")
 
     def get_resource_by_id(
         self, resourceId: str, resourceType: Optional[str] = None
     ) -> "Resource":
-        for r in self._resources:
-            if r.resourceType == resourceType and r.id == resourceId:
-                return r
+        position = self._id_index.get((resourceType, resourceId))
+        if position is not None and self._contains_position(position):
+            return self._resources[position]
         raise ResourceNotFoundError(
             f"Couldn't find a {resourceType} resource with id={resourceId}"
         )
@@ -141,14 +560,24 @@ class SimpleFHIRStore(Generic[R], AbstractFHIRTerminologyServer, AbstractFHIRSer
     def get_resource_by_identifier(
         self, resourceType: str, identifier: "Identifier"
     ) -> "Resource":
-        for r in self._resources:
+        """Find the first resource of `resourceType` with an identifier that has the same system and value as `identifier`.
+        Identifiers without a value are compared on all their fields."""
+        if identifier.value is not None:
+            position = self._identifier_index.get(
+                (resourceType, identifier.system, identifier.value)
+            )
+            if position is not None and self._contains_position(position):
+                return self._resources[position]
+            raise ResourceNotFoundError(
+                f"Couldn't resolver {resourceType} resource with identifier={identifier}"
+            )
+        for r in self.iter():
             if r.resourceType != resourceType:
                 continue
 
-            if isinstance(r, ResourceWithMultiIdentifier):
-                for r_identifier in r.identifier:
-                    if r_identifier == identifier and r.resourceType == resourceType:
-                        return r
+            for r_identifier in self._identifiers(r):
+                if r_identifier == identifier:
+                    return r
 
         raise ResourceNotFoundError(
             f"Couldn't resolver {resourceType} resource with identifier={identifier}"
@@ -157,11 +586,250 @@ class SimpleFHIRStore(Generic[R], AbstractFHIRTerminologyServer, AbstractFHIRSer
     def __getitem__(self, key):
         return self.get_resource_by_literal(key)
 
-    def filter(self, expr: Callable[[R], bool]):
-        return SimpleFHIRStore(
-            [r for r in self.iter() if expr(r)], base_url=self.base_url
+    def _search_index(
+        self, resourceType: str, parameter: SearchParameter
+    ) -> Dict[Hashable, Set[int]]:
+        indexes = self._search_indexes.setdefault(resourceType, {})
+        if parameter.name not in indexes:
+            index: Dict[Hashable, Set[int]] = {}
+            for position in self._type_index.get(resourceType, ()):
+                keys = self._index_keys[position].add_derived(
+                    "search", parameter.name, extract_keys(parameter, self._resources[position])
+                )
+                for key in keys:
+                    index.setdefault(key, set()).add(position)
+            indexes[parameter.name] = index
+        return indexes[parameter.name]
+
+    def _token_index(self, resourceType: str, path: str) -> Dict[Token, Set[int]]:
+        indexes = self._token_indexes.setdefault(resourceType, {})
+        if path not in indexes:
+            index: Dict[Token, Set[int]] = {}
+            for position in self._type_index.get(resourceType, ()):
+                tokens = self._index_keys[position].add_derived(
+                    "token", path, extract_tokens(self._resources[position], path)
+                )
+                for token in tokens:
+                    index.setdefault(token, set()).add(position)
+            indexes[path] = index
+        return indexes[path]
+
+    def _token_positions(
+        self, resourceType: str, path: str, tokens: Iterable[Token]
+    ) -> Set[int]:
+        index = self._token_index(resourceType, path)
+        return set().union(*(index.get(token, ()) for token in tokens))
+
+    def search_codes(
+        self,
+        resourceType: str,
+        field: str,
+        codes: Iterable[Union[Coding, Token, str]],
+    ) -> List[R]:
+        """Find the resources of `resourceType` with one of `codes` in `field` (e.g. "code", "category" or "component.code").
+        Codes are Codings, `(system, code)` tuples or token strings like `http://loinc.org|2160-0`.
+        The (system, code) index of a field is built on its first use and kept up to date afterwards."""
+        tokens = [
+            (str(c.system), c.code)
+            if isinstance(c, Coding)
+            else parse_token(c)
+            if isinstance(c, str)
+            else c
+            for c in codes
+        ]
+        positions = self._token_positions(resourceType, field, tokens)
+        return self._resources_at(positions)
+
+    def search_valueset(
+        self, resourceType: str, field: str, valueset: Union[ValueSet, canonical, str]
+    ) -> List[R]:
+        """Find the resources of `resourceType` with a code in `field` that is a member of a ValueSet or the ValueSet with a canonical url in this store."""
+        if not isinstance(valueset, ValueSet):
+            valueset = self.get_resource_by_canonical(valueset)
+        return self.search_codes(resourceType, field, valueset_tokens(valueset))
+
+    def _date_index(self, resourceType: str, path: str) -> DateIndex:
+        indexes = self._date_indexes.setdefault(resourceType, {})
+        if path not in indexes:
+            indexes[path] = DateIndex(
+                (position, interval)
+                for position in self._type_index.get(resourceType, ())
+                for interval in self._index_keys[position].add_derived(
+                    "date", path, extract_intervals(self._resources[position], path)
+                )
+            )
+        return indexes[path]
+
+    def search_dates(
+        self,
+        resourceType: str,
+        field: str,
+        start: Optional[Union[datetime, str]] = None,
+        end: Optional[Union[datetime, str]] = None,
+    ) -> List[R]:
+        """Find the resources of `resourceType` with a value in `field` (e.g. "effective", "period" or "meta.lastUpdated") that overlaps with the time window from `start` to `end`.
+        Periods are compared as intervals, an open start or end extends to the beginning or end of time. Naive datetimes are taken to be UTC.
+        The sorted index of a field is built on its first use and kept up to date afterwards."""
+        index = self._date_index(resourceType, field)
+        positions = index.search(
+            "ge", _search_interval(start) if start is not None else (MIN_DATETIME, MIN_DATETIME)
+        )
+        if end is not None:
+            positions &= index.search("le", _search_interval(end))
+        return self._resources_at(positions)
+
+    def search(self, resourceType: str, **params: Union[str, Sequence[str]]) -> List[R]:
+        """Find the resources of `resourceType` that match all search parameters, e.g.
+        `store.search("Observation", code="http://loinc.org|2160-0", patient="123", date=["ge2020-01-01", "lt2021"])`.
+
+        Values follow FHIR search syntax: comma separated values match any of them and a list of values has to match all of them.
+        Parameter names with a hyphen can be given with an underscore (e.g. `clinical_status`). See `fhirkit.search` for the supported parameters.
+        Token parameters support the `:in` modifier with the canonical url of a ValueSet in the store, e.g. `**{"code:in": url}`.
+        An index is built for every parameter on its first use and kept up to date afterwards. Resources are returned in the order of the store."""
+        return self._resources_at(self._search_positions(resourceType, **params))
+
+    def _search_positions(
+        self, resourceType: str, **params: Union[str, Sequence[str]]
+    ) -> Set[int]:
+        candidates: Optional[Set[int]] = None
+        date_searches = []
+        for name, value in params.items():
+            name, _, modifier = name.partition(":")
+            if not name.startswith("_"):
+                name = name.replace("_", "-")
+            parameter = get_search_parameter(resourceType, name)
+            if modifier and (modifier, parameter.type) != ("in", "token"):
+                raise ValueError(
+                    f"Modifier '{modifier}' isn't supported for search parameter '{name}'."
+                )
+            for values in split_values(value):
+                if parameter.type == "date":
+                    date_searches.append(
+                        (parameter, [parse_date_search(v) for v in values])
+                    )
+                    continue
+                if parameter.type == "token" and modifier == "in":
+                    matches = set().union(
+                        *(
+                            self._token_positions(
+                                resourceType,
+                                parameter.path,
+                                valueset_tokens(self.get_resource_by_canonical(v)),
+                            )
+                            for v in values
+                        )
+                    )
+                elif parameter.type == "token":
+                    matches = self._token_positions(
+                        resourceType, parameter.path, [parse_token(v) for v in values]
+                    )
+                else:
+                    index = self._search_index(resourceType, parameter)
+                    keys = [parse_reference(v, parameter.target) for v in values]
+                    # a reference by urn:uuid matches the resource with that uuid as id
+                    keys.extend(
+                        f"{URN_UUID_PREFIX}{key.partition('/')[2]}"
+                        for key in keys
+                        if tuple(key.partition("/")[::2]) in self._id_index
+                    )
+                    matches = set().union(*(index.get(key, ()) for key in keys))
+                candidates = matches if candidates is None else candidates & matches
+        if candidates is None:
+            candidates = self._type_index.get(resourceType, set())
+        for parameter, searches in date_searches:
+            index = self._date_index(resourceType, parameter.path)
+            candidates = candidates & set().union(
+                *(index.search(prefix, search) for prefix, search in searches)
+            )
+        return candidates
+
+    def cohort(
+        self, resourceType: Optional[str] = None, **params: Union[str, Sequence[str]]
+    ) -> Cohort[R]:
+        """The resources of `resourceType` (or all resources) that match the search parameters (see `search`) as a bitmap based Cohort, to combine them with other cohorts."""
+        if params:
+            if resourceType is None:
+                raise ValueError("Searching a cohort requires a resourceType.")
+            positions: Iterable[int] = self._search_positions(resourceType, **params)
+        elif resourceType is not None:
+            positions = self._type_index.get(resourceType, ())
+        else:
+            positions = range(len(self._resources))
+        return Cohort(
+            self,
+            bitmap_from_positions(p for p in positions if self._contains_position(p)),
         )
 
+    def patients(
+        self, resourceType: Optional[str] = None, **params: Union[str, Sequence[str]]
+    ) -> PatientCohort:
+        """The patients having a resource of `resourceType` that matches the search parameters as a PatientCohort, e.g.
+        `store.patients("Condition", code=x) - store.patients("Observation", code=y)` for the patients with condition x without observation y."""
+        return self.cohort(resourceType, **params).patients()
+
+    def _patient_cohort_of(self, positions: Iterable[int]) -> PatientCohort:
+        numbers = self._patient_numbers
+        return PatientCohort(
+            self,
+            bitmap_from_positions(
+                numbers[patient_id]
+                for position in positions
+                if self._resources[position] is not None
+                for patient_id in self._index_keys[position].compartment
+                if patient_id in numbers
+            ),
+        )
+
+    def patient_ids(self) -> List[str]:
+        """The ids of the patients that have at least one resource in their compartment."""
+        return [
+            patient_id
+            for patient_id, positions in self._compartment_index.items()
+            if any(self._contains_position(position) for position in positions)
+        ]
+
+    def patient(self, patient_id: str) -> Bundle:
+        """A collection Bundle with the resources in the compartment of a patient: the Patient itself and the resources whose `subject` or `patient` refers to it."""
+        entries = []
+        for resource in self._resources_at(self._compartment_index.get(patient_id, ())):
+            full_url = (
+                f"{str(self.base_url).rstrip('/')}/{resource.resourceType}/{resource.id}"
+                if self.base_url is not None and resource.id is not None
+                else None
+            )
+            # resources are validated already
+            entries.append(BundleEntry.construct(fullUrl=full_url, resource=resource))
+        return Bundle.construct(type="collection", entry=entries)
+
+    def iter_patients(self) -> Generator[Tuple[str, Bundle], None, None]:
+        for patient_id in self.patient_ids():
+            yield patient_id, self.patient(patient_id)
+
+    def map_patients(
+        self, func: Callable[[Bundle], Any], workers: Optional[int] = 1
+    ) -> Dict[str, Any]:
+        """Apply `func` to the Bundle of every patient (see `patient`) and return the results by patient id.
+        With `workers` > 1 (or None to use all cores) the patients are processed in a pool of worker processes, so `func` should be picklable (e.g. a module level function)."""
+        if workers is None:
+            workers = os.cpu_count() or 1
+        patient_ids = self.patient_ids()
+        bundles = (self.patient(patient_id) for patient_id in patient_ids)
+        if workers <= 1:
+            return dict(zip(patient_ids, map(func, bundles)))
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=set_json_backend,
+            initargs=(get_json_backend(),),
+        ) as executor:
+            chunksize = max(len(patient_ids) // (workers * 4), 1)
+            return dict(
+                zip(patient_ids, executor.map(func, bundles, chunksize=chunksize))
+            )
+
+    def filter(self, expr: Callable[[R], bool]) -> "SimpleFHIRStoreView[R]":
+        """A view on the resources for which `expr` returns True, see `SimpleFHIRStoreView`."""
+        return SimpleFHIRStoreView(self, (expr,))
+
     def create_reference(
         self, resource: R, auto_save_in_store: bool = True
     ) -> Reference:
@@ -172,13 +840,86 @@ class SimpleFHIRStore(Generic[R], AbstractFHIRTerminologyServer, AbstractFHIRSer
         self._references.append(reference)
         return reference
 
-    def put_resource(self, resource: R):
-        ## TODO charlotte
-        ## if resource with matching resource.id exists override
-        ## if resource with matching reource.identifier exists raise Error
-        literal_id = uuid4().urn
-        resource.id = literal_id
-        self.resources.append(resource)
+    def put_resource(self, resource: R) -> R:
+        """Create or update a resource: it replaces the resource with the same resourceType and id, a resource without id is given a new one.
+        Unless the resource carries a new `meta.versionId` (e.g. from the server it was read from) it gets the next version number and `meta.lastUpdated` is set to now.
+        The replaced version is kept in the history of the resource when the store was created with `history` > 0.
+        For a resource that was changed in place and put again that is the copy made when it was put before,
+        a resource that was loaded into the store and changed in place has no previous version to keep."""
+        if resource.id is None:
+            resource.id = str(uuid4())
+        key = (resource.resourceType, resource.id)
+        position = self._id_index.get(key)
+        current = self._resources[position] if position is not None else None
+        current_version = current.meta.versionId if current is not None and current.meta is not None else None
+        meta = resource.meta
+        if meta is None or meta.versionId is None or meta.versionId == current_version:
+            if current_version is not None and current_version.isdigit():
+                version = int(current_version) + 1
+            else:
+                version = self._deleted_versions.pop(key, 0) + 1
+            # a new Meta, the old version may share it with the resource. parse_obj validates the new values, copy(update=...) doesn't
+            resource.meta = Meta.parse_obj(
+                {
+                    **(meta.dict() if meta is not None else {}),
+                    "versionId": str(version),
+                    "lastUpdated": datetime.now(timezone.utc).isoformat(timespec="milliseconds").replace("+00:00", "Z"),
+                }
+            )
+        if position is None:
+            self._append_resource(resource)
+        else:
+            # a resource that was changed in place is its own current version, its previous version is the copy that was put
+            previous = self._put_versions.get(key) if current is resource else current
+            if previous is not None:
+                self._remember_version(key, previous)
+            self._replace_resource(position, resource)
+        if self._history_size > 0:
+            # BaseModel.copy leaves out the empty fields, deepcopy keeps a complete model
+            self._put_versions[key] = deepcopy(resource)
+        return resource
+
+    def delete_resource(self, resourceId: str, resourceType: str) -> None:
+        """Delete the resource with `resourceType` and id. Its last version is kept in the history of the resource."""
+        key = (resourceType, resourceId)
+        position = self._id_index.get(key)
+        if position is None:
+            raise ResourceNotFoundError(
+                f"Couldn't find a {resourceType} resource with id={resourceId}"
+            )
+        resource = self._resources[position]
+        self._unindex_resource(position)
+        self._resources[position] = None
+        self._n_deleted += 1
+        self._record_change(position)
+        self._remember_version(key, self._put_versions.pop(key, resource))
+        version = resource.meta.versionId if resource.meta is not None else None
+        if version is not None and version.isdigit():
+            self._deleted_versions[key] = int(version)
+
+    def _remember_version(self, key: Tuple[str, str], resource: R) -> None:
+        if self._history_size > 0:
+            self._history.setdefault(key, deque(maxlen=self._history_size)).append(resource)
+
+    def get_resource_history(self, resourceId: str, resourceType: str) -> List[R]:
+        """The current version of a resource followed by its previous versions, newest first.
+        Only the last `history` previous versions are kept, see `SimpleFHIRStore`."""
+        versions = list(reversed(self._history.get((resourceType, resourceId), ())))
+        try:
+            versions.insert(0, self.get_resource_by_id(resourceId, resourceType))
+        except ResourceNotFoundError:
+            if not versions:
+                raise
+        return versions
+
+    def get_resource_version(self, resourceId: str, resourceType: str, versionId: str) -> R:
+        """The version of a resource with `meta.versionId`, from the current version or the history of the resource."""
+        for resource in self.get_resource_history(resourceId, resourceType):
+            if resource.meta is not None and resource.meta.versionId == versionId:
+                return resource
+        raise ResourceNotFoundError(
+            f"Couldn't find version {versionId} of the {resourceType} resource with id={resourceId}"
+        )
 
     def valueset_expand(self, *args, **kwargs):
         return super().valueset_expand(*args, **kwargs)
@@ -226,7 +967,7 @@ class SimpleFHIRStore(Generic[R], AbstractFHIRTerminologyServer, AbstractFHIRSer
             + "".join(
                 [
                     f"<tr><th>{i}</th><td>{r.resourceType}</td><td>{r.id}</td></tr>"
-                    for i, r in enumerate(self._resources[:10])
+                    for i, r in enumerate(islice(self.iter(), 10))
                 ]
             )
             + "<tr><th>...</th><td>...</td><td>...</td></tr>"
@@ -242,56 +983,527 @@ class SimpleFHIRStore(Generic[R], AbstractFHIRTerminologyServer, AbstractFHIRSer
         )
 
     @classmethod
-    def bulk_import(cls, path: Path):
-        """Load resources from a directory containing NDJSON files with FHIR resources as if they are exported from the FHIR Bulk export API."""
-        resources = []
+    def from_stream(
+        cls,
+        resources: Iterable[R],
+        predicate: Optional[Callable[[R], bool]] = None,
+        base_url: Optional[Union[str, HttpUrl]] = None,
+    ):
+        """Create a store from an iterable of resources (e.g. `iter_bulk_export`). Only resources for which `predicate` returns True are kept in memory."""
+        if predicate is not None:
+            resources = (r for r in resources if predicate(r))
+        return cls(list(resources), base_url=base_url)
+
+    @classmethod
+    def bulk_import(
+        cls,
+        path: Path,
+        workers: Optional[int] = 1,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        resource_types: Optional[Collection[str]] = None,
+        lazy: bool = False,
+        index: bool = False,
+        snapshot: Optional[Union[str, Path]] = None,
+    ):
+        """Load resources from a directory containing NDJSON files with FHIR resources as if they are exported from the FHIR Bulk export API.
+
+        With `workers` > 1 (or None to use all cores) the NDJSON files are split in byte ranges of about `chunk_size` bytes that are parsed in a pool of worker processes.
+        With `resource_types` only resources of these types are loaded. Files named after other resource types (e.g. `Patient.ndjson`) are skipped entirely and lines of other types are skipped before they are decoded.
+        With `lazy` the store holds `LazyResource` proxies that keep the raw JSON and are only validated when a field other than `resourceType`, `id` or `identifier` is accessed.
+        With `index` the workers get their chunks from a line-offset index that is persisted next to every NDJSON file (see `NDJSONFile`) and reused on the next import.
+        With `snapshot` the store is loaded from that snapshot file when it's still up to date with the NDJSON files and the given options, otherwise the store is imported and saved to it (see `save_snapshot`).
+        """
         if isinstance(path, str):
             path = Path(path)
-        target_paths = list(traverse(path, lambda p: p.suffix == ".ndjson"))
+        if workers is None:
+            workers = os.cpu_count() or 1
+        if resource_types is not None:
+            resource_types = frozenset(resource_types)
+        sources = _source_manifest(
+            path,
+            ".ndjson",
+            resource_types=sorted(resource_types) if resource_types else None,
+            lazy=lazy,
+        )
+        if snapshot is not None:
+            try:
+                return cls.load_snapshot(snapshot, expected_sources=sources)
+            except FileNotFoundError:
+                pass
+            except SnapshotOutdatedError:
+                LOGGER.info("Snapshot '%s' is outdated, importing '%s'", snapshot, path)
+            except (ValueError, EOFError, pickle.UnpicklingError):
+                # e.g. a snapshot of an older format or one that was truncated, it's overwritten like an outdated one
+                LOGGER.warning("Couldn't read snapshot '%s', importing '%s'", snapshot, path, exc_info=True)
+        target_paths = list(_ndjson_paths(path, resource_types))
+        start_time = time.perf_counter()
+        if workers > 1:
+            resources, lines_per_file = cls._bulk_import_parallel(
+                target_paths, workers, chunk_size, resource_types, lazy, index
+            )
+        else:
+            resources, lines_per_file = cls._bulk_import_sequential(
+                path, target_paths, resource_types, lazy
+            )
+        n_lines = sum(lines_per_file.values())
+        elapsed = time.perf_counter() - start_time
+        LOGGER.info(
+            "Parsed %d lines from '%s' in %.1fs (%.0f lines/sec)",
+            n_lines,
+            str(path.absolute()),
+            elapsed,
+            n_lines / elapsed if elapsed > 0 else float("inf"),
+        )
+        store = cls(resources)
+        store._sources = sources
+        for fpath in target_paths:
+            size, mtime_ns = sources["files"][str(fpath.absolute())]
+            store._ingested[str(fpath.absolute())] = IngestedFile(
+                size, mtime_ns, lines_per_file[fpath], _fingerprint(fpath, size)
+            )
+        if snapshot is not None:
+            store.save_snapshot(snapshot)
+        return store
+
+    @staticmethod
+    def _bulk_import_sequential(
+        path: Path,
+        target_paths: Sequence[Path],
+        resource_types: Optional[AbstractSet[str]] = None,
+        lazy: bool = False,
+    ):
+        resources = []
+        lines_per_file: Dict[Path, int] = defaultdict(int)
         for fpath in tqdm(target_paths):
-            for i, line in tqdm(
-                enumerate(open(fpath, "r")), desc=str(path), leave=True
+            with open(fpath, "r") as f:
+                for i, resource in tqdm(
+                    parse_ndjson_lines(f, resource_types, lazy), desc=str(path), leave=True
+                ):
+                    lines_per_file[fpath] = i + 1
+                    if isinstance(resource, ValidationError):
+                        LOGGER.warning(
+                            "Couldn't parse line %d from '%s'",
+                            i,
+                            str(fpath.absolute()),
+                            exc_info=resource,
+                        )
+                    elif resource is not None:
+                        resources.append(resource)
+        return resources, lines_per_file
+
+    @staticmethod
+    def _bulk_import_parallel(
+        target_paths: Sequence[Path],
+        workers: int,
+        chunk_size: int,
+        resource_types: Optional[AbstractSet[str]] = None,
+        lazy: bool = False,
+        index: bool = False,
+    ):
+        resources = []
+        parse_chunk = partial(
+            parse_ndjson_chunk, resource_types=resource_types, lazy=lazy
+        )
+        tasks = [
+            (fpath, start, end)
+            for fpath in target_paths
+            for start, end in split_ndjson(fpath, chunk_size, use_index=index)
+        ]
+        # line numbers are relative to each chunk, chunks of a file are merged in order to report absolute line numbers
+        line_offsets: Dict[Path, int] = defaultdict(int)
+        # workers use the same JSON backend, also when they don't inherit the state of this process
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=set_json_backend,
+            initargs=(get_json_backend(),),
+        ) as executor:
+            results = executor.map(parse_chunk, *zip(*tasks)) if tasks else []
+            for (fpath, _, _), (chunk_resources, chunk_lines, failures) in tqdm(
+                zip(tasks, results), total=len(tasks), unit="chunk"
             ):
-                try:
-                    resources.append(parse_json_as_resource(line))
-                except ValidationError:
+                for i, exc in failures:
                     LOGGER.warning(
                         "Couldn't parse line %d from '%s'",
-                        i,
+                        line_offsets[fpath] + i,
                         str(fpath.absolute()),
-                        exc_info=True,
+                        exc_info=exc,
                     )
-        return cls(resources)
+                line_offsets[fpath] += chunk_lines
+                resources.extend(chunk_resources)
+        return resources, line_offsets
 
     @classmethod
-    def load_bundles(cls, path: Path, fail_when_invalid: bool = False):
-        """Load resources from a directory containing JSON files with FHIR Bundle resources per Patients."""
+    def load_bundles(
+        cls,
+        path: Path,
+        fail_when_invalid: bool = False,
+        resource_types: Optional[Collection[str]] = None,
+    ):
+        """Load resources from a directory containing JSON files with FHIR Bundle resources per Patients.
+        Every file is decoded once and each `entry.resource` is validated directly with the model for its resourceType.
+        With `resource_types` only entries with a resource of these types are validated and loaded."""
         resources: List[R] = []
         if isinstance(path, str):
             path = Path(path)
+        sources = _source_manifest(
+            path,
+            ".json",
+            resource_types=sorted(resource_types) if resource_types else None,
+        )
         target_paths = list(traverse(path, lambda p: p.suffix == ".json"))
         for fpath in tqdm(target_paths):
-            bundle: Bundle = parse_file_as(Bundle, fpath)
-            for i, entry in tqdm(enumerate(bundle.entry), desc=str(fpath), leave=True):
-                if entry.resource is None:
+            try:
+                bundle = json_loads(fpath.read_bytes())
+            except ValueError:
+                LOGGER.warning(
+                    "Couldn't decode '%s'", str(fpath.absolute()), exc_info=True
+                )
+                continue
+            if not isinstance(bundle, dict) or bundle.get("resourceType") != "Bundle":
+                LOGGER.warning(
+                    "'%s' doesn't contain a Bundle resource.", str(fpath.absolute())
+                )
+                continue
+            entries = bundle.get("entry") or []
+            for i, entry in tqdm(enumerate(entries), desc=str(fpath), leave=True):
+                if not isinstance(entry, dict):
+                    LOGGER.warning(
+                        "Entry %d in Bundle with path %s isn't an object.",
+                        i,
+                        str(fpath.absolute()),
+                    )
+                    continue
+                resource = entry.get("resource")
+                if not isinstance(resource, dict):
                     LOGGER.warning(
                         "Entry %d in Bundle with path %s has no resoruce.",
                         i,
                         str(fpath.absolute()),
                     )
                     continue
+                if (
+                    resource_types is not None
+                    and resource.get("resourceType") not in resource_types
+                ):
+                    continue
                 try:
-                    resources.append(
-                        parse_obj_as(AnyPatientResource, entry.resource.dict())
-                    )
+                    resources.append(parse_obj_as_resource(resource))
                 except ValidationError:
                     LOGGER.warning(
                         "Couldn't load entry %d (fullURL='%s') from '%s'",
                         i,
-                        entry.fullUrl,
+                        entry.get("fullUrl"),
                         str(fpath.absolute()),
                         exc_info=True,
                     )
                     if fail_when_invalid:
                         raise StopIteration("Invalid resource.")
-        return cls(resources)
+        store = cls(resources)
+        store._sources = sources
+        return store
+
+    def sync_bulk_export(
+        self,
+        path: Union[str, Path],
+        resource_types: Optional[Collection[str]] = None,
+        lazy: bool = False,
+    ) -> int:
+        """Load the data that was added to a bulk export directory since the store was created with `bulk_import` or last synced.
+        New NDJSON files are parsed completely, of files that were appended to only the new lines are parsed and files that were otherwise changed are parsed again.
+        A last line without a newline is left for the next sync, as it may still be written to.
+        Parsed resources replace the resource with the same resourceType and id in the store, others are added. Resources are never removed.
+        Synced resources keep the `meta` of the export, unlike `put_resource` they don't get a new version, but the version they replace is kept in the history.
+        Returns the number of resources that were added or replaced."""
+        if isinstance(path, str):
+            path = Path(path)
+        if resource_types is not None:
+            resource_types = frozenset(resource_types)
+        sources = _source_manifest(
+            path,
+            ".ndjson",
+            resource_types=sorted(resource_types) if resource_types else None,
+            lazy=lazy,
+        )
+        n_synced = 0
+        for fpath in _ndjson_paths(path, resource_types):
+            key = str(fpath.absolute())
+            size, mtime_ns = sources["files"][key]
+            ingested = self._ingested.get(key)
+            if ingested is not None and (ingested.size, ingested.mtime_ns) == (
+                size,
+                mtime_ns,
+            ):
+                continue
+            start, first_line = 0, 0
+            if (
+                ingested is not None
+                and size > ingested.size
+                and _fingerprint(fpath, ingested.size) == ingested.fingerprint
+            ):
+                start, first_line = ingested.size, ingested.n_lines
+            # a line without a newline may still be written to, it's parsed by a later sync
+            end = complete_lines_end(fpath, start, size)
+            resources, n_lines, failures = parse_ndjson_chunk(
+                fpath, start, end, resource_types, lazy
+            )
+            for i, exc in failures:
+                LOGGER.warning(
+                    "Couldn't parse line %d from '%s'",
+                    first_line + i,
+                    key,
+                    exc_info=exc,
+                )
+            for resource in resources:
+                id_key = (resource.resourceType, resource.id)
+                position = self._id_index.get(id_key)
+                if position is None:
+                    self._append_resource(resource)
+                else:
+                    self._remember_version(id_key, self._put_versions.pop(id_key, self._resources[position]))
+                    self._replace_resource(position, resource)
+            n_synced += len(resources)
+            self._ingested[key] = IngestedFile(
+                end, mtime_ns, first_line + n_lines, _fingerprint(fpath, end)
+            )
+        self._sources = sources
+        return n_synced
+
+    def export_ndjson(
+        self,
+        directory: Union[str, Path],
+        gzip: bool = False,
+        workers: Optional[int] = 1,
+        chunk_size: int = DEFAULT_EXPORT_CHUNK_SIZE,
+    ) -> Dict[str, Path]:
+        """Write the resources to `directory` the way the FHIR Bulk Data API lays out its output: a `<resourceType>.ndjson` file (`.ndjson.gz` with `gzip`) per resourceType.
+        The resources are streamed to buffered files in the order of the store, so memory use doesn't grow with the size of the store.
+        With `workers` > 1 (or None to use all cores) chunks of `chunk_size` resources are serialised in a pool of worker processes.
+        Returns the path of the file of every resourceType."""
+        if isinstance(directory, str):
+            directory = Path(directory)
+        if workers is None:
+            workers = os.cpu_count() or 1
+        directory.mkdir(parents=True, exist_ok=True)
+        suffix = ".ndjson.gz" if gzip else ".ndjson"
+        paths: Dict[str, Path] = {}
+        files: Dict[str, IO[bytes]] = {}
+
+        def write(resource: R, line: bytes) -> None:
+            f = files.get(resource.resourceType)
+            if f is None:
+                path = paths[resource.resourceType] = directory / f"{resource.resourceType}{suffix}"
+                f = files[resource.resourceType] = open_ndjson_writer(path, gzip)
+            f.write(line)
+
+        try:
+            if workers <= 1:
+                for resource in self.iter():
+                    write(resource, ndjson_line(resource))
+                return paths
+            resources = self.iter()
+            chunks = iter(lambda: list(islice(resources, chunk_size)), [])
+            with ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=set_json_backend,
+                initargs=(get_json_backend(),),
+            ) as executor:
+                # a bounded number of chunks is in flight, the lines are written in order as they come back
+                pending: Deque = deque()
+                for chunk in chunks:
+                    pending.append((chunk, executor.submit(serialize_ndjson_chunk, chunk)))
+                    if len(pending) >= 2 * workers:
+                        chunk, future = pending.popleft()
+                        for resource, line in zip(chunk, future.result()):
+                            write(resource, line)
+                for chunk, future in pending:
+                    for resource, line in zip(chunk, future.result()):
+                        write(resource, line)
+            return paths
+        finally:
+            for f in files.values():
+                f.close()
+
+    def save_snapshot(self, path: Union[str, Path]) -> None:
+        """Save the store, with its validated resources and indexes, to a binary snapshot that `load_snapshot` restores without validating the resources again.
+        A store that was created with `bulk_import` or `load_bundles` also records the size and modification time of the files it was loaded from.
+        The snapshot is written to a temporary file next to `path` that replaces it when complete, so an interrupted save doesn't leave a truncated snapshot behind."""
+        path = Path(path)
+        fd, tmp_path = tempfile.mkstemp(prefix=f".{path.name}.", suffix=".tmp", dir=path.parent)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(SNAPSHOT_MAGIC)
+                # the manifest is pickled separately, so an outdated snapshot is rejected before the resources are read
+                pickle.dump(self._sources, f, protocol=pickle.HIGHEST_PROTOCOL)
+                pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    @classmethod
+    def load_snapshot(
+        cls,
+        path: Union[str, Path],
+        expected_sources: Optional[Dict[str, Any]] = None,
+    ):
+        """Restore a store that was saved with `save_snapshot`.
+        Raises a SnapshotOutdatedError when one of the files the store was loaded from has been changed, added or removed since, or when the manifest doesn't match `expected_sources`.
+        Snapshots are pickles, only load snapshots you created yourself."""
+        with open(path, "rb") as f:
+            if f.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+                raise ValueError(f"'{path}' isn't a {cls.__name__} snapshot.")
+            sources = pickle.load(f)
+            if expected_sources is None and sources is not None:
+                try:
+                    expected_sources = _source_manifest(
+                        Path(sources["root"]), sources["suffix"], **sources["options"]
+                    )
+                except FileNotFoundError:
+                    expected_sources = None
+            if sources != expected_sources:
+                raise SnapshotOutdatedError(
+                    f"The files in snapshot '{path}' have changed since it was saved."
+                )
+            store = pickle.load(f)
+        if not isinstance(store, cls):
+            raise TypeError(
+                f"'{path}' contains a {type(store).__name__}, not a {cls.__name__}."
+            )
+        return store
+
+
+class SimpleFHIRStoreView(SimpleFHIRStore[R]):
+    """Read-only view on the resources of a SimpleFHIRStore for which a chain of predicates returns True.
+
+    A view shares the resources and indexes of its store instead of copying them: it only keeps the positions of its resources, in an int64 array.
+    These positions are determined the first time the view is used, so filtering a view that isn't used yet only composes the predicates.
+    Resources that are put, deleted or synced into the store later are evaluated again the next time the view is used, so a view doesn't go stale.
+    The lookup and search methods of the store work on a view and only return resources in the view. Use `materialize` to get an independent store.
+    """
+
+    def __init__(
+        self,
+        store: SimpleFHIRStore[R],
+        predicates: Sequence[Callable[[R], bool]] = (),
+        source: Optional[array] = None,
+    ) -> None:
+        if isinstance(store, SimpleFHIRStoreView):
+            store = store._store
+        # share the storage and indexes of the store
+        self.__dict__.update(store.__dict__)
+        self._store = store
+        self._predicates = tuple(predicates)
+        # positions of the store the predicates are evaluated on, all resources when None
+        self._source = source
+        self._positions: Optional[array] = None
+        # how many of the predicates the resources in the source already match
+        self._n_source_predicates = 0
+        # a source that isn't described by the predicates (e.g. of a cohort) only loses positions when the store changes
+        self._fixed_source = source is not None
+        # how many changes of the store the positions (or the source) include
+        self._n_changes = 0
+        if source is not None:
+            self._n_changes = store._changes_offset + len(store._changed_positions)
+            store._views.add(self)
+
+    def _matches(self, position: int, first_predicate: int = 0) -> bool:
+        resource = self._resources[position]
+        return resource is not None and all(
+            predicate(resource) for predicate in self._predicates[first_predicate:]
+        )
+
+    @property
+    def positions(self) -> array:
+        changes = self._changed_positions
+        offset = self._store._changes_offset
+        if self._positions is None:
+            source = self._source
+            if source is None:
+                self._n_changes = offset + len(changes)
+                self._store._views.add(self)
+                source = range(len(self._resources))
+            self._positions = array(
+                "q",
+                (p for p in source if self._matches(p, self._n_source_predicates)),
+            )
+        if self._n_changes < offset + len(changes):
+            changed = set(changes[self._n_changes - offset :])
+            self._n_changes = offset + len(changes)
+            positions = [position for position in self._positions if position not in changed]
+            if self._fixed_source:
+                changed.intersection_update(self._positions)
+            positions.extend(filter(self._matches, changed))
+            self._positions = array("q", sorted(positions))
+        return self._positions
+
+    def _contains_position(self, position: int) -> bool:
+        positions = self.positions
+        i = bisect_left(positions, position)
+        return i < len(positions) and positions[i] == position
+
+    def iter(self):
+        resources = self._resources
+        for position in self.positions:
+            yield resources[position]
+
+    def __len__(self):
+        return len(self.positions)
+
+    def get_resource_by_id(
+        self, resourceId: str, resourceType: Optional[str] = None
+    ) -> "Resource":
+        try:
+            return super().get_resource_by_id(resourceId, resourceType)
+        except ResourceNotFoundError:
+            # the index refers to the first resource with the id, which can be outside the view
+            if (resourceType, resourceId) not in self._id_index:
+                raise
+        for r in self.iter():
+            if r.resourceType == resourceType and r.id == resourceId:
+                return r
+        raise ResourceNotFoundError(
+            f"Couldn't find a {resourceType} resource with id={resourceId}"
+        )
+
+    def get_resource_by_identifier(
+        self, resourceType: str, identifier: "Identifier"
+    ) -> "Resource":
+        try:
+            return super().get_resource_by_identifier(resourceType, identifier)
+        except ResourceNotFoundError:
+            key = (resourceType, identifier.system, identifier.value)
+            if key not in self._identifier_index:
+                raise
+        for r in self.iter():
+            if r.resourceType == resourceType and key in self._identifier_keys(r):
+                return r
+        raise ResourceNotFoundError(
+            f"Couldn't resolver {resourceType} resource with identifier={identifier}"
+        )
+
+    def filter(self, expr: Callable[[R], bool]) -> "SimpleFHIRStoreView[R]":
+        if self._positions is None:
+            view = SimpleFHIRStoreView(self._store, self._predicates + (expr,), self._source)
+            view._n_source_predicates = self._n_source_predicates
+        else:
+            # the positions are only evaluated with `expr`, changed resources later on with all predicates
+            view = SimpleFHIRStoreView(self._store, self._predicates + (expr,), self.positions)
+            view._n_source_predicates = len(self._predicates)
+        view._fixed_source = self._fixed_source
+        view._n_changes = self._n_changes
+        return view
+
+    def materialize(self) -> SimpleFHIRStore[R]:
+        """Copy the resources in the view into a new store."""
+        return SimpleFHIRStore(
+            list(self.iter()), references=self._references, base_url=self.base_url
+        )
+
+    def put_resource(self, resource: R):
+        raise TypeError("A view is read-only, put the resource in the store it was created from.")
+
+    def delete_resource(self, resourceId: str, resourceType: str) -> None:
+        raise TypeError("A view is read-only, delete the resource from the store it was created from.")
+
+    def sync_bulk_export(self, *args, **kwargs) -> int:
+        raise TypeError("A view is read-only, sync the store it was created from.")
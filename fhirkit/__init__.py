@@ -1,3 +1,4 @@
+from .json_backend import set_json_backend, get_json_backend
 from .Resource import Resource
 from .elements import (
     CodeableConcept, 
@@ -50,4 +51,12 @@ from .Patient import Patient
 from .Device import Device
 from .ClinicalImpression import ClinicalImpression
 from .Composition import Composition, CompositionEventType,CompositionRelatesTo,CompositionSection
-from .SimpleFHIRStore import SimpleFHIRStore
\ No newline at end of file
+from .LazyResource import LazyResource
+from .ndjson import NDJSONFile
+from .cohort import Cohort, PatientCohort
+from .SimpleFHIRStore import (
+    SimpleFHIRStore,
+    SimpleFHIRStoreView,
+    SnapshotOutdatedError,
+    iter_bulk_export,
+)
\ No newline at end of file
@@ -1,5 +1,6 @@
-from typing import TYPE_CHECKING, Any, Dict, Type
+from typing import TYPE_CHECKING, Any, Dict, Tuple, Type
 from pydantic.fields import ModelField
+from pydantic.typing import is_union
 
 if TYPE_CHECKING:
     from fhirkit.BaseModel import BaseModel
@@ -20,6 +21,38 @@ def get_matching_type(value: Any, field: ModelField):
     raise TypeError(f"{value} doesn't match any of the specified types ", field.type_)
 
 
+def choice_type_suffix(type_class: type) -> str:
+    """The suffix of a choice type field for values of `type_class`, e.g. `Quantity` or `DateTime` for a datetime."""
+    type_name = type_class.__name__
+    type_name = TYPE_NAME_ALIAS.get(type_name, type_name)
+    return type_name[0].upper() + type_name[1:]
+
+
+class ChoiceTypeKeys(Dict[type, str]):
+    """Dispatch table from the type of the value of a choice type field to its FHIR key, e.g. `valueQuantity` for a Quantity in `Observation.value`.
+    The allowed types of the field are looked up up front, other types (e.g. subclasses) are resolved once and cached."""
+
+    def __init__(self, field: ModelField) -> None:
+        self.name = field.name
+        type_ = field.type_
+        types = type_.__args__ if is_union(getattr(type_, "__origin__", None)) else (type_,)
+        self.types: Tuple[type, ...] = tuple(t for t in types if t is not type(None))
+        super().__init__((t, self.name + choice_type_suffix(t)) for t in self.types)
+
+    def __missing__(self, value_type: type) -> str:
+        # the first allowed type the value is an instance of, like get_matching_type
+        matching = next((t for t in self.types if issubclass(value_type, t)), None)
+        if matching is not None:
+            key = self[matching]
+        elif any(issubclass(t, value_type) for t in self.types):
+            # validators of subclasses of builtin types can return the builtin type, e.g. a datetime for a dateTime
+            key = self.name + choice_type_suffix(value_type)
+        else:
+            raise TypeError(f"{value_type} doesn't match any of the specified types of {self.name}[x]", self.types)
+        self[value_type] = key
+        return key
+
+
 def deterimine_choice_type(
     cls: Type["BaseModel"], v: Any, values: Dict[str, Any], field: ModelField
 ):
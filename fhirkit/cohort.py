@@ -0,0 +1,125 @@
+"""Cohorts of resources or patients of a `SimpleFHIRStore`, represented as bitmaps.
+
+A bitmap is a Python int in which bit `i` is set when the resource at position `i` of the store (or the patient with number `i`) is part of the cohort.
+Set operations on cohorts are bitwise operations on these ints, which run in C over machine words instead of over Python objects.
+"""
+from array import array
+from typing import TYPE_CHECKING, Generic, Iterable, Iterator, List, TypeVar
+
+if TYPE_CHECKING:
+    from fhirkit.Resource import Resource
+    from fhirkit.SimpleFHIRStore import SimpleFHIRStore, SimpleFHIRStoreView
+
+R = TypeVar("R", bound="Resource")
+
+
+def bitmap_from_positions(positions: Iterable[int]) -> int:
+    """Set the bits at `positions`."""
+    data = bytearray()
+    for position in positions:
+        byte = position >> 3
+        if byte >= len(data):
+            data.extend(bytes(byte - len(data) + 1))
+        data[byte] |= 1 << (position & 7)
+    return int.from_bytes(data, "little")
+
+
+def positions_from_bitmap(bitmap: int) -> Iterator[int]:
+    """The positions of the set bits in increasing order."""
+    data = bitmap.to_bytes((bitmap.bit_length() + 7) // 8, "little")
+    for byte_position, byte in enumerate(data):
+        while byte:
+            low = byte & -byte
+            yield (byte_position << 3) + low.bit_length() - 1
+            byte ^= low
+
+
+class _Bitmap:
+    def __init__(self, store: "SimpleFHIRStore", bitmap: int = 0) -> None:
+        self.store = store
+        self.bitmap = bitmap
+
+    def _combine(self, other: "_Bitmap", bitmap: int):
+        if type(other) is not type(self) or other.store._resources is not self.store._resources:
+            raise ValueError(f"Can only combine with a {type(self).__name__} of the same store.")
+        return type(self)(self.store, bitmap)
+
+    def __and__(self, other):
+        return self._combine(other, self.bitmap & other.bitmap)
+
+    def __or__(self, other):
+        return self._combine(other, self.bitmap | other.bitmap)
+
+    def __sub__(self, other):
+        return self._combine(other, self.bitmap & ~other.bitmap)
+
+    def __xor__(self, other):
+        return self._combine(other, self.bitmap ^ other.bitmap)
+
+    def __len__(self) -> int:
+        return self.bitmap.bit_count()
+
+    def __bool__(self) -> bool:
+        return self.bitmap != 0
+
+    def __eq__(self, other: object) -> bool:
+        return (
+            type(other) is type(self)
+            and other.store._resources is self.store._resources
+            and other.bitmap == self.bitmap
+        )
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({len(self)})"
+
+
+class Cohort(_Bitmap, Generic[R]):
+    """A set of resources of a store, e.g. the result of `store.cohort("Observation", code="2160-0")`.
+    Cohorts of the same store are combined with `&` (intersection), `|` (union), `-` (difference) and `^`."""
+
+    @property
+    def positions(self) -> array:
+        return array("q", positions_from_bitmap(self.bitmap))
+
+    def __iter__(self) -> Iterator[R]:
+        resources = self.store._resources
+        for position in positions_from_bitmap(self.bitmap):
+            # resources can be deleted from the store after the cohort was created
+            if resources[position] is not None:
+                yield resources[position]
+
+    def view(self) -> "SimpleFHIRStoreView[R]":
+        """The resources in the cohort as a view on the store."""
+        from fhirkit.SimpleFHIRStore import SimpleFHIRStoreView
+
+        return SimpleFHIRStoreView(self.store, source=self.positions)
+
+    def patients(self) -> "PatientCohort":
+        """The patients in whose compartment at least one of the resources is."""
+        return self.store._patient_cohort_of(positions_from_bitmap(self.bitmap))
+
+
+class PatientCohort(_Bitmap):
+    """A set of patients of a store, e.g. patients having X and not Y:
+    `store.patients("Condition", code=x) - store.patients("Observation", code=y)`."""
+
+    @property
+    def patient_ids(self) -> List[str]:
+        ids = self.store._patient_ids
+        return [ids[number] for number in positions_from_bitmap(self.bitmap)]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.patient_ids)
+
+    def resources(self) -> Cohort:
+        """The resources in the compartments of the patients."""
+        compartments = self.store._compartment_index
+        return Cohort(
+            self.store,
+            bitmap_from_positions(
+                position
+                for patient_id in self.patient_ids
+                for position in compartments.get(patient_id, ())
+                if self.store._contains_position(position)
+            ),
+        )
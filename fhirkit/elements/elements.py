@@ -1,6 +1,5 @@
 from __future__ import annotations
 from functools import total_ordering
-import itertools
 from typing import TYPE_CHECKING, Any, Generic, Optional, Sequence, TypeVar, Union
 
 try:
@@ -123,9 +122,8 @@ class CodeableConcept(BaseModel):
             result = any(other == c for c in self.coding)
             return result
         elif isinstance(other, CodeableConcept):
-            return any(
-                c1 == c2 for c1, c2 in itertools.product(self.coding, other.coding)
-            )
+            codes = {(c.system, c.code) for c in self.coding}
+            return any((c.system, c.code) in codes for c in other.coding)
         else:
             return False
 
@@ -0,0 +1,116 @@
+"""Pluggable JSON codec used to parse and serialise FHIR resources.
+
+The standard library `json` module is used by default. A faster library can be opted into with
+`set_json_backend("orjson")`, `set_json_backend("msgspec")` or `set_json_backend("auto")` (the first installed one),
+or by setting the `FHIRKIT_JSON_BACKEND` environment variable to one of these names before `fhirkit` is imported.
+"""
+import importlib.util
+import json
+import os
+from typing import Any, Callable, Optional, Union
+
+JSON_BACKENDS = ("json", "orjson", "msgspec")
+FAST_JSON_BACKENDS = ("orjson", "msgspec")
+
+Default = Optional[Callable[[Any], Any]]
+
+_backend = "json"
+_loads: Callable[[Union[str, bytes]], Any] = json.loads
+_dumps: Callable[[Any, Default], bytes]
+
+
+def _stdlib_dumps(obj: Any, default: Default = None) -> bytes:
+    # compact UTF-8 like the fast libraries and BaseModel.json_bytes write
+    return json.dumps(obj, default=default, separators=(",", ":"), ensure_ascii=False).encode()
+
+
+def _with_float_subclasses(default: Default) -> Callable[[Any], Any]:
+    # the fast libraries only serialise exact floats, the stdlib also handles subclasses like `decimal`
+    def wrapped(obj: Any) -> Any:
+        if isinstance(obj, float):
+            return float(obj)
+        if default is None:
+            raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+        return default(obj)
+
+    return wrapped
+
+
+def _load_orjson():
+    import orjson
+
+    def dumps(obj: Any, default: Default = None) -> bytes:
+        return orjson.dumps(obj, default=_with_float_subclasses(default))
+
+    return orjson.loads, dumps
+
+
+def _load_msgspec():
+    import msgspec
+
+    decoder = msgspec.json.Decoder()
+
+    def loads(data: Union[str, bytes]) -> Any:
+        try:
+            return decoder.decode(data)
+        except msgspec.DecodeError as exc:
+            # keep the contract of json.loads so callers only need to catch ValueError
+            raise ValueError(str(exc)) from exc
+
+    def dumps(obj: Any, default: Default = None) -> bytes:
+        return msgspec.json.encode(obj, enc_hook=_with_float_subclasses(default))
+
+    return loads, dumps
+
+
+def available_json_backends():
+    """Names of the JSON backends that can be used in this environment."""
+    return ("json",) + tuple(
+        name for name in FAST_JSON_BACKENDS if importlib.util.find_spec(name) is not None
+    )
+
+
+def set_json_backend(name: str = "auto") -> str:
+    """Select the library used to decode and encode JSON. Returns the name of the selected backend.
+    With "auto" the first installed fast library is selected, falling back to the standard library."""
+    global _backend, _loads, _dumps
+    if name == "auto":
+        name = next(
+            (n for n in FAST_JSON_BACKENDS if n in available_json_backends()), "json"
+        )
+    if name == "json":
+        _loads, _dumps = json.loads, _stdlib_dumps
+    elif name == "orjson":
+        _loads, _dumps = _load_orjson()
+    elif name == "msgspec":
+        _loads, _dumps = _load_msgspec()
+    else:
+        raise ValueError(
+            f"Unknown JSON backend '{name}', expected one of {', '.join(JSON_BACKENDS)} or 'auto'."
+        )
+    _backend = name
+    return name
+
+
+def get_json_backend() -> str:
+    return _backend
+
+
+def json_loads(data: Union[str, bytes]) -> Any:
+    """Decode a JSON document with the selected backend. Raises a ValueError for invalid JSON."""
+    return _loads(data)
+
+
+def json_dumps_bytes(obj: Any, default: Default = None) -> bytes:
+    """Encode an object as UTF-8 JSON with the selected backend."""
+    return _dumps(obj, default)
+
+
+def json_dumps(obj: Any, default: Default = None) -> str:
+    """Encode an object as a JSON string with the selected backend."""
+    if _backend == "json":
+        return json.dumps(obj, default=default)
+    return _dumps(obj, default).decode()
+
+
+set_json_backend(os.environ.get("FHIRKIT_JSON_BACKEND", "json"))
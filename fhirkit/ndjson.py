@@ -0,0 +1,283 @@
+from array import array
+from bisect import bisect_left
+import gzip
+import io
+import mmap
+import os
+from pathlib import Path
+import re
+import struct
+import sys
+from typing import (
+    IO,
+    AbstractSet,
+    Generator,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
+
+from pydantic import ValidationError
+
+from fhirkit.LazyResource import LazyResource
+from fhirkit.Resource import Resource
+from fhirkit.parse import parse_json_as_resource, sniff_resource_types
+from fhirkit.primitive_datatypes import RESOURCE_TYPES
+
+DEFAULT_CHUNK_SIZE = 64 * 1024 * 1024
+# resources serialised per task when an export is spread over worker processes
+DEFAULT_EXPORT_CHUNK_SIZE = 1000
+WRITE_BUFFER_SIZE = 1024 * 1024
+FILENAME_RESOURCE_TYPE_PATTERN = re.compile(r"[A-Za-z]+")
+INDEX_SUFFIX = ".idx"
+INDEX_HEADER = struct.Struct("<8sqq")
+INDEX_MAGIC = b"FKNDJIX1"
+
+
+def resource_type_from_filename(path: Path) -> Optional[str]:
+    """Derive the resourceType from a bulk export file name like `Observation.ndjson` or `Observation-2.ndjson`.
+    Returns None when the file name doesn't start with a FHIR resource type."""
+    match = FILENAME_RESOURCE_TYPE_PATTERN.match(path.name)
+    if match is None or match.group() not in RESOURCE_TYPES:
+        return None
+    return match.group()
+
+
+def skip_ndjson_file(path: Path, resource_types: Optional[AbstractSet[str]]) -> bool:
+    """Check based on its name if a bulk export file can't contain any of `resource_types`."""
+    if resource_types is None:
+        return False
+    resource_type = resource_type_from_filename(path)
+    return resource_type is not None and resource_type not in resource_types
+
+
+def skip_ndjson_line(
+    line: Union[str, bytes], resource_types: Optional[AbstractSet[str]]
+) -> bool:
+    """Check without decoding the JSON if a line can't contain a resource of one of `resource_types`.
+    Lines without a recognisable resourceType are never skipped, so they still produce a validation error."""
+    if resource_types is None:
+        return False
+    sniffed = sniff_resource_types(line)
+    return len(sniffed) > 0 and sniffed.isdisjoint(resource_types)
+
+
+def split_ndjson(
+    path: Path, chunk_size: int = DEFAULT_CHUNK_SIZE, use_index: bool = False
+) -> Generator[Tuple[int, int], None, None]:
+    """Split an NDJSON file in byte ranges of roughly `chunk_size` bytes. Every range starts at the beginning of a line and ends right after a newline (or at the end of the file).
+    With `use_index` the ranges are taken from the line-offset index persisted next to the file, which is built first when it's missing or outdated."""
+    if chunk_size <= 0:
+        raise ValueError("chunk_size should be a positive number of bytes.")
+    if use_index:
+        with NDJSONFile(path, persist_index=True) as f:
+            for start, end, _ in f.ranges(chunk_size):
+                yield start, end
+        return
+    size = path.stat().st_size
+    with open(path, "rb") as f:
+        start = 0
+        while start < size:
+            f.seek(min(start + chunk_size, size))
+            # move on to the end of the line we landed in
+            f.readline()
+            end = f.tell()
+            yield start, end
+            start = end
+
+
+def complete_lines_end(path: Path, start: int, end: int) -> int:
+    """The offset right after the last newline in the byte range [start, end) of an NDJSON file, or `start` when the range holds no newline.
+    A line that is still being written has no newline yet, it's left out until it is complete."""
+    with open(path, "rb") as f:
+        while end > start:
+            block_start = max(end - io.DEFAULT_BUFFER_SIZE, start)
+            f.seek(block_start)
+            newline = f.read(end - block_start).rfind(b"\n")
+            if newline >= 0:
+                return block_start + newline + 1
+            end = block_start
+    return start
+
+
+def parse_ndjson_lines(
+    lines: Iterable[Union[str, bytes]],
+    resource_types: Optional[AbstractSet[str]] = None,
+    lazy: bool = False,
+) -> Generator[Tuple[int, Union[Resource, ValidationError, None]], None, None]:
+    """Parse the lines of an NDJSON file. Yields the number of every line together with its resource,
+    the ValidationError when it failed to parse or None when the line holds a resource that isn't one of `resource_types`.
+    Lines that can't contain one of `resource_types` are skipped before they are decoded.
+    With `lazy` the lines are wrapped in a `LazyResource` instead of being validated."""
+    parse = LazyResource if lazy else parse_json_as_resource
+    for i, line in enumerate(lines):
+        if skip_ndjson_line(line, resource_types):
+            yield i, None
+            continue
+        try:
+            resource = parse(line)
+        except ValidationError as exc:
+            yield i, exc
+            continue
+        if resource_types is None or resource.resourceType in resource_types:
+            yield i, resource
+        else:
+            yield i, None
+
+
+def parse_ndjson_chunk(
+    path: Path,
+    start: int,
+    end: int,
+    resource_types: Optional[AbstractSet[str]] = None,
+    lazy: bool = False,
+) -> Tuple[List[Resource], int, List[Tuple[int, ValidationError]]]:
+    """Parse the lines in the byte range [start, end) of an NDJSON file, see `parse_ndjson_lines`.
+    Returns the parsed resources, the number of lines that were read and the (chunk relative) line numbers that failed to parse together with their validation error.
+    This function is meant to be executed in a worker process and therefore doesn't log anything itself."""
+    resources: List[Resource] = []
+    failures: List[Tuple[int, ValidationError]] = []
+    with open(path, "rb") as f:
+        f.seek(start)
+        data = f.read(end - start)
+    n_lines = 0
+    # iterate like a file opened in text mode to keep the line numbering identical to a sequential import
+    lines = io.StringIO(data.decode("utf-8"), newline=None)
+    for i, result in parse_ndjson_lines(lines, resource_types, lazy):
+        n_lines = i + 1
+        if isinstance(result, ValidationError):
+            failures.append((i, result))
+        elif result is not None:
+            resources.append(result)
+    return resources, n_lines, failures
+
+
+def ndjson_line(resource: Resource) -> bytes:
+    """The FHIR JSON of a resource as a line of an NDJSON file, including the newline.
+    A LazyResource that isn't materialized is written from its raw JSON, without validating it."""
+    return resource.json_bytes() + b"\n"
+
+
+def serialize_ndjson_chunk(resources: Iterable[Resource]) -> List[bytes]:
+    """The NDJSON lines of `resources`, meant to be executed in a worker process."""
+    return [ndjson_line(resource) for resource in resources]
+
+
+def open_ndjson_writer(path: Path, compress: bool = False) -> IO[bytes]:
+    """Open an NDJSON file for buffered writing, gzip compressed with `compress`."""
+    if compress:
+        return io.BufferedWriter(gzip.GzipFile(path, "wb"), WRITE_BUFFER_SIZE)
+    return open(path, "wb", buffering=WRITE_BUFFER_SIZE)
+
+
+class NDJSONFile:
+    """Random access to the lines of an NDJSON file.
+
+    The file is memory-mapped and indexed with the byte offset at which every line starts (an int64 array with one extra entry for the end of the file).
+    With `persist_index` the index is saved next to the file (e.g. `Observation.ndjson.idx`), so reopening an unchanged file doesn't scan it again.
+    """
+
+    def __init__(self, path: Union[str, Path], persist_index: bool = False) -> None:
+        self.path = Path(path)
+        self._file = open(self.path, "rb")
+        stat = os.fstat(self._file.fileno())
+        self._size = stat.st_size
+        self._mtime_ns = stat.st_mtime_ns
+        # an empty file can't be memory-mapped
+        self._mmap = (
+            mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            if self._size > 0
+            else b""
+        )
+        offsets = self._load_index()
+        if offsets is None:
+            offsets = self._build_index()
+            if persist_index:
+                self._save_index(offsets)
+        self.offsets = offsets
+
+    @property
+    def index_path(self) -> Path:
+        return self.path.with_name(self.path.name + INDEX_SUFFIX)
+
+    def _build_index(self) -> array:
+        offsets = array("q", [0])
+        find = self._mmap.find
+        pos = find(b"\n")
+        while pos != -1:
+            offsets.append(pos + 1)
+            pos = find(b"\n", pos + 1)
+        # the last line doesn't necessarily end with a newline
+        if offsets[-1] != self._size:
+            offsets.append(self._size)
+        return offsets
+
+    def _load_index(self) -> Optional[array]:
+        try:
+            with open(self.index_path, "rb") as f:
+                magic, size, mtime_ns = INDEX_HEADER.unpack(f.read(INDEX_HEADER.size))
+                if (magic, size, mtime_ns) != (INDEX_MAGIC, self._size, self._mtime_ns):
+                    return None
+                offsets = array("q")
+                offsets.frombytes(f.read())
+        except (OSError, struct.error, ValueError):
+            return None
+        if sys.byteorder == "big":
+            offsets.byteswap()
+        return offsets
+
+    def _save_index(self, offsets: array) -> None:
+        data = array("q", offsets)
+        if sys.byteorder == "big":
+            data.byteswap()
+        with open(self.index_path, "wb") as f:
+            f.write(INDEX_HEADER.pack(INDEX_MAGIC, self._size, self._mtime_ns))
+            f.write(data.tobytes())
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> bytes:
+        """The raw bytes of line `i` without its line ending."""
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(f"{self.path} has {len(self)} lines, can't read line {i}.")
+        return self._mmap[self.offsets[i] : self.offsets[i + 1]].rstrip(b"\r\n")
+
+    def __iter__(self) -> Iterator[bytes]:
+        for i in range(len(self)):
+            yield self[i]
+
+    def parse(self, i: int) -> Resource:
+        """Parse line `i` into its resource model."""
+        return parse_json_as_resource(self[i])
+
+    def ranges(
+        self, chunk_size: int = DEFAULT_CHUNK_SIZE
+    ) -> Generator[Tuple[int, int, int], None, None]:
+        """Split the file in byte ranges of roughly `chunk_size` bytes on line boundaries.
+        Yields the start and end offset of every range together with the number of its first line."""
+        if chunk_size <= 0:
+            raise ValueError("chunk_size should be a positive number of bytes.")
+        line = 0
+        while line < len(self):
+            start = self.offsets[line]
+            end_line = max(bisect_left(self.offsets, start + chunk_size), line + 1)
+            end_line = min(end_line, len(self))
+            yield start, self.offsets[end_line], line
+            line = end_line
+
+    def close(self) -> None:
+        if isinstance(self._mmap, mmap.mmap):
+            self._mmap.close()
+        self._file.close()
+
+    def __enter__(self) -> "NDJSONFile":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
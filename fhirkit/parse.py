@@ -1,5 +1,5 @@
-from importlib.resources import Resource
-from typing import List, Union
+import re
+from typing import Any, List, Set, Union
 import typing
 
 
@@ -8,14 +8,69 @@ try:
 except ImportError:
     from typing_extensions import Annotated  # type: ignore
 
-from pydantic import Field, parse_obj_as
-from fhirkit.Resource import RESOURCE_MODELS
+from pydantic import Field, ValidationError
+from pydantic.error_wrappers import ErrorWrapper
+from pydantic.errors import InvalidDiscriminator, MissingDiscriminator
+from pydantic.utils import ROOT_KEY
+from fhirkit.json_backend import json_loads
+from fhirkit.Resource import RESOURCE_MODELS_BY_TYPE, Resource
+
+RESOURCE_TYPE_PATTERN = re.compile(r'"resourceType"\s*:\s*"(\w+)"')
+RESOURCE_TYPE_PATTERN_BYTES = re.compile(RESOURCE_TYPE_PATTERN.pattern.encode())
 
 AnyPatientResource = Annotated[
-    Union[tuple(RESOURCE_MODELS)],
+    Union[tuple(RESOURCE_MODELS_BY_TYPE.values())],
     Field(discriminator="resourceType"),
 ]
 
 
-def parse_json_as_resource(json: str):
-    return parse_obj_as(AnyPatientResource, json)
+def parse_obj_as_resource(obj: Any) -> Resource:
+    """Validate a decoded FHIR resource with the model registered for its `resourceType`.
+    Gives the same result as `parse_obj_as(AnyPatientResource, obj)` without going through pydantic's Union validation.
+    Unlike the Union, that only holds the models registered when this module is imported, every registered model is accepted, e.g. a Bundle."""
+    try:
+        resource_type = obj["resourceType"]
+    except (TypeError, KeyError):
+        raise ValidationError(
+            [
+                ErrorWrapper(
+                    MissingDiscriminator(discriminator_key="resourceType"),
+                    loc=ROOT_KEY,
+                )
+            ],
+            Resource,
+        )
+    # e.g. a list or dict as resourceType would fail the lookup with a TypeError
+    model = RESOURCE_MODELS_BY_TYPE.get(resource_type) if isinstance(resource_type, str) else None
+    if model is None:
+        raise ValidationError(
+            [
+                ErrorWrapper(
+                    InvalidDiscriminator(
+                        discriminator_key="resourceType",
+                        discriminator_value=resource_type,
+                        allowed_values=list(RESOURCE_MODELS_BY_TYPE),
+                    ),
+                    loc=ROOT_KEY,
+                )
+            ],
+            Resource,
+        )
+    return model.parse_obj(obj)
+
+
+def parse_json_as_resource(json: Union[str, bytes]) -> Resource:
+    """Decode a JSON document once and validate it with the model registered for its `resourceType`."""
+    try:
+        obj = json_loads(json)
+    except ValueError as exc:
+        raise ValidationError([ErrorWrapper(exc, loc=ROOT_KEY)], Resource)
+    return parse_obj_as_resource(obj)
+
+
+def sniff_resource_types(json: Union[str, bytes]) -> Set[str]:
+    """Find the resourceTypes mentioned in a raw JSON document without decoding it.
+    Contained resources are found as well, so the result is a superset of the resourceType of the document itself."""
+    if isinstance(json, bytes):
+        return {m.decode() for m in RESOURCE_TYPE_PATTERN_BYTES.findall(json)}
+    return set(RESOURCE_TYPE_PATTERN.findall(json))
@@ -0,0 +1,405 @@
+"""FHIR search parameters supported by `SimpleFHIRStore.search`.
+
+Every parameter extracts index keys from a resource:
+token parameters yield `(system, code)` pairs, reference parameters yield the referenced `Type/id` (and the bare id)
+and date parameters yield `(start, end)` intervals in UTC. More info: https://www.hl7.org/fhir/search.html
+"""
+from bisect import bisect_left, bisect_right, insort
+from datetime import date, datetime, timedelta, timezone
+import re
+import sys
+from typing import (
+    Any,
+    Dict,
+    Generator,
+    Hashable,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+)
+
+from fhirkit.elements import CodeableConcept, Coding, Identifier, Period, Reference
+from fhirkit.LazyResource import PATIENT_REFERENCE_FIELDS, LazyResource
+from fhirkit.ValueSet import ValueSet
+
+Interval = Tuple[datetime, datetime]
+Token = Tuple[Optional[str], Optional[str]]
+
+MIN_DATETIME = datetime.min.replace(tzinfo=timezone.utc)
+MAX_DATETIME = datetime.max.replace(tzinfo=timezone.utc)
+DATE_PREFIXES = ("eq", "ne", "gt", "lt", "ge", "le")
+DATE_PATTERN = re.compile(
+    r"(?P<year>\d{4})(-(?P<month>\d{2})(-(?P<day>\d{2})(T(?P<time>[0-9:.]+)(?P<tz>Z|[+-]\d{2}:\d{2})?)?)?)?"
+)
+REFERENCE_PATTERN = re.compile(r"(?:^|/)(?P<type>[A-Za-z]+)/(?P<id>[A-Za-z0-9\-\.]{1,64})$")
+URN_UUID_PREFIX = "urn:uuid:"
+
+
+class SearchParameter(NamedTuple):
+    name: str
+    type: str
+    path: str
+    # restricts reference parameters to references of this resource type (e.g. `patient`)
+    target: Optional[str] = None
+
+
+def _parameters(*parameters: SearchParameter) -> Dict[str, SearchParameter]:
+    return {p.name: p for p in parameters}
+
+
+COMMON_SEARCH_PARAMETERS = _parameters(
+    SearchParameter("_id", "token", "id"),
+    SearchParameter("_lastUpdated", "date", "meta.lastUpdated"),
+)
+
+SEARCH_PARAMETERS: Dict[str, Dict[str, SearchParameter]] = {
+    "Observation": _parameters(
+        SearchParameter("code", "token", "code"),
+        SearchParameter("category", "token", "category"),
+        SearchParameter("status", "token", "status"),
+        SearchParameter("subject", "reference", "subject"),
+        SearchParameter("patient", "reference", "subject", target="Patient"),
+        SearchParameter("encounter", "reference", "encounter"),
+        SearchParameter("date", "date", "effective"),
+    ),
+    "Condition": _parameters(
+        SearchParameter("code", "token", "code"),
+        SearchParameter("category", "token", "category"),
+        SearchParameter("clinical-status", "token", "clinicalStatus"),
+        SearchParameter("verification-status", "token", "verificationStatus"),
+        SearchParameter("subject", "reference", "subject"),
+        SearchParameter("patient", "reference", "subject", target="Patient"),
+        SearchParameter("encounter", "reference", "encounter"),
+        SearchParameter("onset-date", "date", "onset"),
+    ),
+    "Procedure": _parameters(
+        SearchParameter("code", "token", "code"),
+        SearchParameter("category", "token", "category"),
+        SearchParameter("status", "token", "status"),
+        SearchParameter("subject", "reference", "subject"),
+        SearchParameter("patient", "reference", "subject", target="Patient"),
+        SearchParameter("encounter", "reference", "encounter"),
+        SearchParameter("date", "date", "performed"),
+    ),
+    "Encounter": _parameters(
+        SearchParameter("class", "token", "class_"),
+        SearchParameter("type", "token", "type"),
+        SearchParameter("status", "token", "status"),
+        SearchParameter("subject", "reference", "subject"),
+        SearchParameter("patient", "reference", "subject", target="Patient"),
+        SearchParameter("date", "date", "period"),
+    ),
+    "Patient": _parameters(
+        SearchParameter("identifier", "token", "identifier"),
+        SearchParameter("gender", "token", "gender"),
+        SearchParameter("birthdate", "date", "birthDate"),
+    ),
+}
+
+
+def get_search_parameter(resource_type: str, name: str) -> SearchParameter:
+    parameter = SEARCH_PARAMETERS.get(resource_type, {}).get(
+        name, COMMON_SEARCH_PARAMETERS.get(name)
+    )
+    if parameter is None:
+        raise ValueError(
+            f"Search parameter '{name}' isn't supported for {resource_type} resources."
+        )
+    return parameter
+
+
+def _attribute(value: Any, name: str) -> Any:
+    attribute = getattr(value, name, None)
+    if attribute is None:
+        # not every model fills its choice type from the typed field (e.g. `onsetPeriod`) or declares the typed fields at all
+        for key, item in getattr(value, "__dict__", {}).items():
+            if key.startswith(name) and key[len(name) : len(name) + 1].isupper():
+                if item is not None:
+                    return item
+    return attribute
+
+
+def _values(resource: Any, path: str) -> List[Any]:
+    if isinstance(resource, LazyResource):
+        resource = resource.materialize()
+    values = [resource]
+    for name in path.split("."):
+        next_values = []
+        for value in values:
+            value = _attribute(value, name)
+            if isinstance(value, (list, tuple)):
+                next_values.extend(value)
+            elif value is not None:
+                next_values.append(value)
+        values = next_values
+    return values
+
+
+def _token_keys(value: Any) -> Generator[Token, None, None]:
+    if isinstance(value, CodeableConcept):
+        for coding in value.coding or ():
+            yield from _token_keys(coding)
+    elif isinstance(value, (Coding, Identifier)):
+        system = value.system
+        code = value.code if isinstance(value, Coding) else value.value
+        if system is not None:
+            yield str(system), None
+            if code is not None:
+                yield str(system), str(code)
+        if code is not None:
+            yield None, str(code)
+    elif isinstance(value, str):
+        yield None, value
+
+
+def _reference_keys(value: Any, target: Optional[str]) -> Generator[str, None, None]:
+    if not isinstance(value, Reference) or value.reference is None:
+        return
+    match = REFERENCE_PATTERN.search(value.reference)
+    if match is None:
+        # e.g. urn:uuid references, which can refer to a resource of any type unless it's given
+        if value.type is None or target is None or value.type == target:
+            yield value.reference
+        return
+    if target is not None and match.group("type") != target:
+        return
+    yield f"{match.group('type')}/{match.group('id')}"
+    yield match.group("id")
+
+
+def patient_compartment(resource: Any) -> Set[str]:
+    """The ids of the patients in whose compartment a resource is, based on its `subject` and `patient` references.
+    A Patient is in its own compartment. Unvalidated `LazyResource`s are read from the references extracted up front.
+    `urn:uuid:` references (e.g. between the entries of a Bundle) are returned as is, a store resolves them against the ids of its Patients."""
+    if resource.resourceType == "Patient":
+        return {resource.id} if resource.id is not None else set()
+    if isinstance(resource, LazyResource):
+        references = resource.patient_references()
+    else:
+        values = (getattr(resource, name, None) for name in PATIENT_REFERENCE_FIELDS)
+        references = tuple((v.reference, v.type) for v in values if isinstance(v, Reference))
+    patient_ids = set()
+    for reference, reference_type in references:
+        if reference is None:
+            continue
+        if reference.startswith(URN_UUID_PREFIX):
+            if reference_type in (None, "Patient"):
+                patient_ids.add(reference)
+            continue
+        match = REFERENCE_PATTERN.search(reference)
+        if match is not None and match.group("type") == "Patient":
+            patient_ids.add(match.group("id"))
+    return patient_ids
+
+
+def _utc(value: datetime) -> datetime:
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+def parse_date_interval(value: str) -> Interval:
+    """The interval that is implied by the precision of a (partial) date like `2020`, `2020-03`, `2020-03-01` or `2020-03-01T10:00:00Z`."""
+    match = DATE_PATTERN.fullmatch(value)
+    if match is None:
+        raise ValueError(f"Invalid date '{value}'.")
+    year = int(match.group("year"))
+    if match.group("month") is None:
+        start = datetime(year, 1, 1, tzinfo=timezone.utc)
+        end = start.replace(year=year + 1) if year < 9999 else MAX_DATETIME
+    elif match.group("day") is None:
+        month = int(match.group("month"))
+        start = datetime(year, month, 1, tzinfo=timezone.utc)
+        end = (start + timedelta(days=31)).replace(day=1)
+    elif match.group("time") is None:
+        start = datetime(year, int(match.group("month")), int(match.group("day")), tzinfo=timezone.utc)
+        end = start + timedelta(days=1)
+    else:
+        instant = _utc(datetime.fromisoformat(value.replace("Z", "+00:00")))
+        return instant, instant
+    return start, end - timedelta(microseconds=1)
+
+
+def _date_interval(value: Any) -> Optional[Interval]:
+    if isinstance(value, datetime):
+        value = _utc(value)
+        return value, value
+    if isinstance(value, date):
+        return parse_date_interval(value.isoformat())
+    if isinstance(value, Period):
+        if value.start is None and value.end is None:
+            return None
+        start = _utc(value.start) if value.start is not None else MIN_DATETIME
+        end = _utc(value.end) if value.end is not None else MAX_DATETIME
+        return start, end
+    if isinstance(value, dict):
+        # a Period that was kept as an extra field
+        try:
+            return _date_interval(Period.parse_obj(value))
+        except ValueError:
+            return None
+    if isinstance(value, str):
+        try:
+            return parse_date_interval(value)
+        except ValueError:
+            return None
+    # e.g. Age or Range onsets can't be compared with dates
+    return None
+
+
+def extract_tokens(resource: Any, path: str) -> Set[Token]:
+    """The `(system, code)` tokens of the codes, codings, identifiers or strings in a field of `resource`.
+    Every coding also yields `(system, None)` and `(None, code)` to match a code in any system and any code in a system."""
+    tokens: Set[Token] = set()
+    for value in _values(resource, path):
+        tokens.update(_token_keys(value))
+    return tokens
+
+
+def extract_keys(parameter: SearchParameter, resource: Any) -> Iterable[Hashable]:
+    """The index keys of `resource` for a reference search parameter."""
+    keys = set()
+    for value in _values(resource, parameter.path):
+        keys.update(_reference_keys(value, parameter.target))
+    return keys
+
+
+def extract_intervals(resource: Any, path: str) -> List[Interval]:
+    """The UTC intervals of the dates, datetimes or Periods in a field of `resource`."""
+    intervals = (_date_interval(v) for v in _values(resource, path))
+    return [i for i in intervals if i is not None]
+
+
+def parse_token(value: str) -> Token:
+    """Parse a token search value `[system|]code` or `system|` into the index key it matches."""
+    if "|" not in value:
+        return None, value
+    system, code = value.split("|", 1)
+    if not system:
+        # `|code` (explicitly without system) matches like a bare code
+        return None, code
+    return system, code or None
+
+
+def valueset_tokens(valueset: ValueSet) -> Set[Token]:
+    """The `(system, code)` tokens of the concepts in a ValueSet, taken from its expansion or else from the concepts and systems its compose includes."""
+    if valueset.expansion is not None:
+        return {
+            (str(c.system) if c.system is not None else None, c.code)
+            for c in valueset.expansion.contains
+        }
+    if valueset.compose is None:
+        raise ValueError(f"ValueSet {valueset.url} has no expansion or compose.")
+    tokens: Set[Token] = set()
+    for include in valueset.compose.include:
+        if include.filter or include.valueSet:
+            raise ValueError(
+                f"ValueSet {valueset.url} has to be expanded to evaluate its filters and included ValueSets."
+            )
+        system = str(include.system) if include.system is not None else None
+        if include.concept:
+            tokens.update((system, concept.code) for concept in include.concept)
+        else:
+            # all codes of the system
+            tokens.add((system, None))
+    for exclude in valueset.compose.exclude:
+        system = str(exclude.system) if exclude.system is not None else None
+        tokens.difference_update((system, concept.code) for concept in exclude.concept)
+    return tokens
+
+
+def parse_reference(value: str, target: Optional[str]) -> str:
+    """Parse a reference search value `[Type/]id` or an absolute url into the index key it matches."""
+    match = REFERENCE_PATTERN.search(value)
+    if match is not None:
+        return f"{match.group('type')}/{match.group('id')}"
+    if target is not None and "/" not in value and ":" not in value:
+        return f"{target}/{value}"
+    return value
+
+
+def parse_date_search(value: str) -> Tuple[str, Interval]:
+    """Parse a date search value with an optional prefix, e.g. `ge2020-01-01`, into the prefix and the interval of the date."""
+    prefix = value[:2] if value[:2].isalpha() else "eq"
+    if prefix not in DATE_PREFIXES:
+        raise ValueError(
+            f"Unsupported date prefix '{prefix}', expected one of {', '.join(DATE_PREFIXES)}."
+        )
+    return prefix, parse_date_interval(value[2:] if value[:2].isalpha() else value)
+
+
+def match_date(prefix: str, search: Interval, interval: Interval) -> bool:
+    """Compare the interval of a resource value with a search interval like FHIR date search does."""
+    (search_start, search_end), (start, end) = search, interval
+    if prefix == "eq":
+        return search_start <= start and end <= search_end
+    if prefix == "ne":
+        return not (search_start <= start and end <= search_end)
+    if prefix == "gt":
+        return end > search_end
+    if prefix == "lt":
+        return start < search_start
+    if prefix == "ge":
+        return end >= search_start
+    # le
+    return start <= search_end
+
+
+def split_values(value: Any) -> Sequence[Sequence[str]]:
+    """Split a search argument in the values that are combined with AND (a list of strings) and OR (comma separated)."""
+    if isinstance(value, str):
+        value = [value]
+    return [v.split(",") for v in value]
+
+
+class DateIndex:
+    """The intervals of a date field, sorted by start and by end, so a date search bisects to the matching range instead of comparing every resource.
+    A resource matches when one of its intervals matches, like `match_date`."""
+
+    def __init__(self, entries: Iterable[Tuple[int, Interval]] = ()) -> None:
+        self._by_start = sorted((start, end, position) for position, (start, end) in entries)
+        self._by_end = sorted((end, start, position) for start, end, position in self._by_start)
+
+    def add(self, position: int, intervals: Iterable[Interval]) -> None:
+        for start, end in intervals:
+            insort(self._by_start, (start, end, position))
+            insort(self._by_end, (end, start, position))
+
+    def remove(self, position: int, intervals: Iterable[Interval]) -> None:
+        for start, end in intervals:
+            for entries, entry in (
+                (self._by_start, (start, end, position)),
+                (self._by_end, (end, start, position)),
+            ):
+                i = bisect_left(entries, entry)
+                if i < len(entries) and entries[i] == entry:
+                    del entries[i]
+
+    @staticmethod
+    def _after(value: datetime) -> Tuple[datetime, datetime, int]:
+        # sorts after every entry that starts with `value`
+        return value, MAX_DATETIME, sys.maxsize
+
+    def search(self, prefix: str, search: Interval) -> Set[int]:
+        search_start, search_end = search
+        by_start, by_end = self._by_start, self._by_end
+        if prefix == "eq":
+            first = bisect_left(by_start, (search_start,))
+            last = bisect_right(by_start, self._after(search_end))
+            return {p for _, end, p in by_start[first:last] if end <= search_end}
+        if prefix == "ne":
+            before = by_start[: bisect_left(by_start, (search_start,))]
+            after = by_end[bisect_right(by_end, self._after(search_end)) :]
+            return {p for _, _, p in before} | {p for _, _, p in after}
+        if prefix == "gt":
+            return {p for _, _, p in by_end[bisect_right(by_end, self._after(search_end)) :]}
+        if prefix == "lt":
+            return {p for _, _, p in by_start[: bisect_left(by_start, (search_start,))]}
+        if prefix == "ge":
+            return {p for _, _, p in by_end[bisect_left(by_end, (search_start,)) :]}
+        # le
+        return {p for _, _, p in by_start[: bisect_right(by_start, self._after(search_end))]}
@@ -0,0 +1,27 @@
+"""Factories for the FHIR JSON of the resources the tests put in a store."""
+
+
+def patient(i, **fields):
+    return {"resourceType": "Patient", "id": f"p{i}", **fields}
+
+
+def observation(i, patient_id, code="2160-0", effective=None, **fields):
+    resource = {
+        "resourceType": "Observation",
+        "id": f"o{i}",
+        "subject": {"reference": f"Patient/{patient_id}"},
+        "code": {"coding": [{"system": "http://loinc.org", "code": code}]},
+    }
+    if effective is not None:
+        resource["effectiveDateTime"] = effective
+    return {**resource, **fields}
+
+
+def condition(i, patient_id, code, **fields):
+    return {
+        "resourceType": "Condition",
+        "id": f"c{i}",
+        "subject": {"reference": f"Patient/{patient_id}"},
+        "code": {"coding": [{"system": "http://snomed.info/sct", "code": code}]},
+        **fields,
+    }
@@ -0,0 +1,81 @@
+from datetime import datetime
+import json
+
+import pytest
+
+import fhirkit.BaseModel
+from fhirkit import Encounter, Observation, Patient
+from fhirkit.Bundle import Bundle
+from fhirkit.choice_type.validators import ChoiceTypeKeys
+from fhirkit.elements import Duration, Quantity
+from fhirkit.elements.Timing import TimingRepeat
+
+
+@pytest.fixture
+def models():
+    observation = Observation.parse_file("./test/observation.json")
+    encounter = Encounter.parse_obj(
+        {
+            "resourceType": "Encounter",
+            "status": "finished",
+            "class": {"system": "http://terminology.hl7.org/CodeSystem/v3-ActCode", "code": "AMB"},
+            "period": {"start": "2020-02-01T08:00:00Z"},
+            "extension": [],
+        }
+    )
+    # a Patient with an extra field and a value that is empty after the conversion
+    patient = Patient.parse_obj({"resourceType": "Patient", "id": "p1", "photo": [{"title": ""}], "extra": {"a": [1]}})
+    bundle = Bundle.parse_obj(
+        {
+            "resourceType": "Bundle",
+            "type": "collection",
+            "entry": [{"resource": r.dict(by_alias=True)} for r in (observation, encounter)],
+        }
+    )
+    return [observation, encounter, patient, bundle]
+
+
+@pytest.mark.parametrize(
+    "options",
+    [{}, {"by_alias": True}, {"exclude_none": True}, {"exclude_empty": False}],
+)
+def test_compiled_serializer_matches_pydantic(models, options, monkeypatch):
+    compiled = [m.dict(**options) for m in models] + [m.json() for m in models]
+    monkeypatch.setattr(fhirkit.BaseModel, "_model_serializer", lambda cls: None)
+    assert compiled == [m.dict(**options) for m in models] + [m.json() for m in models]
+
+
+def test_choice_type_keys(models):
+    observation, encounter, patient, _ = models
+    assert "valueQuantity" in json.loads(observation.json())
+    assert "value" in observation.dict() and "valueQuantity" not in observation.dict()
+    assert encounter.dict(by_alias=True)["class"]["code"] == "AMB"
+    assert "extension" not in encounter.dict()
+    assert patient.dict() == {"resourceType": "Patient", "id": "p1", "photo": [{}], "extra": {"a": [1]}}
+    # options the compiled serializer doesn't support use pydantic's _iter
+    assert patient.dict(include={"id"}) == {"id": "p1"}
+
+
+@pytest.mark.parametrize(
+    "options",
+    [{}, {"by_alias": False}, {"exclude_none": False}, {"exclude_empty": False}],
+)
+def test_json_bytes_matches_json(models, options):
+    for model in models:
+        assert json.loads(model.json_bytes(**options)) == json.loads(model.json(**options))
+    patient = Patient(id="p1", name=[{"family": "Müller\n"}])
+    assert patient.json_bytes() == '{"resourceType":"Patient","id":"p1","name":[{"family":"Müller\\n"}]}'.encode()
+
+
+def test_choice_type_dispatch():
+    keys = ChoiceTypeKeys(Observation.__fields__["value"])
+    assert keys[Quantity] == "valueQuantity" and keys[datetime] == "valueDateTime"
+    # bool is a subclass of int, the exact type decides
+    assert keys[bool] == "valueBoolean" and keys[int] == "valueInteger"
+    assert Duration not in keys and keys[Duration] == "valueQuantity" and Duration in keys
+    with pytest.raises(TypeError):
+        keys[dict]
+    assert "valueBoolean" in json.loads(Observation.construct(code={"text": "smoker"}, value=True).json())
+    repeat = TimingRepeat(bounds=Duration(value=3, unit="d"))
+    assert repeat.dict(by_alias=True) == {"boundsDuration": {"value": 3, "unit": "d"}}
+    assert json.loads(Patient(multipleBirth=2).json_bytes())["multipleBirthInteger"] == 2
@@ -0,0 +1,58 @@
+import io
+import json
+
+import pytest
+
+from fhirkit import LazyResource, Observation, Patient, SimpleFHIRStore
+from fhirkit.Bundle import Bundle, BundleWriter
+
+
+@pytest.fixture
+def store():
+    return SimpleFHIRStore(
+        [
+            Patient(id="p1"),
+            LazyResource('{"resourceType": "Observation", "id": "o1", "code": {"text": "weight"}}'),
+            Observation(id="6c5fdf6c-0bb0-4e8b-a4ee-5a8d2b4a3d7e", code={"text": "height"}),
+        ]
+    )
+
+
+def test_bundle_writer(store):
+    f = io.BytesIO()
+    with BundleWriter(f, "collection", base_url="http://example.org/fhir/", id="b1") as writer:
+        assert writer.write_all(store.iter()) == 3
+    bundle = Bundle.parse_raw(f.getvalue())
+    assert bundle.id == "b1" and bundle.type == "collection"
+    assert [e.fullUrl for e in bundle.entry] == [
+        "http://example.org/fhir/Patient/p1",
+        "http://example.org/fhir/Observation/o1",
+        "http://example.org/fhir/Observation/6c5fdf6c-0bb0-4e8b-a4ee-5a8d2b4a3d7e",
+    ]
+    # the lazy resource is written from its raw JSON
+    assert not store.get_resource_by_id("o1", "Observation").is_materialized
+    assert [e.resource.code["text"] for e in bundle.entry[1:]] == ["weight", "height"]
+
+
+def test_bundle_writer_searchset(store):
+    f = io.BytesIO()
+    with BundleWriter(f, "searchset") as writer:
+        for resource in store.filter(lambda r: r.resourceType == "Observation"):
+            writer.write(resource)
+        writer.write(store.get_resource_by_id("p1", "Patient"), search={"mode": "include"})
+    document = json.loads(f.getvalue())
+    # the included Patient isn't part of the total
+    assert document["total"] == 2
+    assert [e.get("fullUrl") for e in document["entry"]] == [
+        None,
+        "urn:uuid:6c5fdf6c-0bb0-4e8b-a4ee-5a8d2b4a3d7e",
+        None,
+    ]
+    assert [e["search"]["mode"] for e in Bundle.parse_obj(document).dict()["entry"]] == ["match", "match", "include"]
+    with pytest.raises(ValueError):
+        writer.write(store.get_resource_by_id("p1", "Patient"))
+
+    f = io.BytesIO()
+    with BundleWriter(f, "searchset", total=0):
+        pass
+    assert json.loads(f.getvalue()) == {"resourceType": "Bundle", "type": "searchset", "total": 0}
@@ -0,0 +1,72 @@
+from random import Random
+
+import pytest
+
+from fhirkit import Condition, Observation, Patient, SimpleFHIRStore
+from fhirkit.cohort import Cohort, bitmap_from_positions, positions_from_bitmap
+
+from .conftest import condition, observation
+
+
+@pytest.fixture
+def store():
+    return SimpleFHIRStore(
+        [Patient(id=f"p{i}") for i in range(4)]
+        + [
+            Condition.parse_obj(condition(0, "p0", "44054006")),
+            Condition.parse_obj(condition(1, "p1", "44054006")),
+            Condition.parse_obj(condition(2, "p2", "38341003")),
+            Observation.parse_obj(observation(0, "p0", "4548-4")),
+            Observation.parse_obj(observation(1, "p2", "4548-4")),
+            Observation.parse_obj(observation(2, "p3", "2160-0")),
+        ]
+    )
+
+
+def test_bitmap_round_trip():
+    positions = sorted(set(Random(0).sample(range(10_000), 500)))
+    bitmap = bitmap_from_positions(reversed(positions))
+    assert list(positions_from_bitmap(bitmap)) == positions
+    assert bitmap_from_positions([]) == 0 and list(positions_from_bitmap(0)) == []
+
+
+def test_cohort_algebra(store):
+    conditions = store.cohort("Condition")
+    diabetes = store.cohort("Condition", code="44054006")
+    hba1c = store.cohort("Observation", code="4548-4")
+    assert [r.id for r in diabetes] == ["c0", "c1"]
+    assert [r.id for r in conditions - diabetes] == ["c2"]
+    assert [r.id for r in diabetes | hba1c] == ["c0", "c1", "o0", "o1"]
+    assert len(diabetes & hba1c) == 0
+    assert len(store.cohort()) == len(store)
+    assert [r.id for r in (conditions - diabetes).view().search("Condition", code="38341003")] == ["c2"]
+    with pytest.raises(ValueError):
+        diabetes & SimpleFHIRStore().cohort()
+
+
+def test_patient_cohorts(store):
+    # patients with diabetes without an HbA1c measurement
+    patients = store.patients("Condition", code="44054006") - store.patients("Observation", code="4548-4")
+    assert patients.patient_ids == ["p1"]
+    assert [r.id for r in patients.resources()] == ["p1", "c1"]
+    assert (store.patients("Condition") & store.patients("Observation")).patient_ids == ["p0", "p2"]
+    assert len(store.patients()) == 4
+
+    # cohorts of a view are restricted to the view
+    view = store.filter(lambda r: r.resourceType != "Observation")
+    assert isinstance(view.cohort(), Cohort) and len(view.cohort()) == 7
+    assert [r.id for r in view.patients("Condition", code="38341003").resources()] == ["p2", "c2"]
+
+
+def test_cohort_view_after_puts():
+    store = SimpleFHIRStore()
+    for i in range(3):
+        store.put_resource(Patient(id=f"p{i}"))
+    store.put_resource(Observation.parse_obj(observation(1, "p0")))
+    view = store.cohort("Observation").view()
+    assert [r.id for r in view] == ["o1"]
+    # resources put later don't join the cohort, deleted ones leave it
+    store.put_resource(Observation.parse_obj(observation(2, "p0")))
+    assert [r.id for r in view] == ["o1"] and [r.id for r in view.filter(lambda r: True)] == ["o1"]
+    store.delete_resource("o1", "Observation")
+    assert len(view) == 0
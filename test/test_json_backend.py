@@ -0,0 +1,47 @@
+import json
+
+import pytest
+
+from fhirkit import Observation, get_json_backend, set_json_backend
+from fhirkit.json_backend import available_json_backends, json_loads
+from fhirkit.parse import parse_json_as_resource
+
+OBSERVATION = {
+    "resourceType": "Observation",
+    "id": "o1",
+    "code": {"coding": [{"system": "http://loinc.org", "code": "2160-0", "display": "Créatinine"}]},
+    "effectiveDateTime": "2019-02-02T10:00:00+01:00",
+    "valueQuantity": {"value": 1.1, "unit": "mg/dL"},
+}
+
+
+@pytest.fixture(params=available_json_backends())
+def backend(request):
+    previous = get_json_backend()
+    yield set_json_backend(request.param)
+    set_json_backend(previous)
+
+
+def test_parse_and_serialise(backend):
+    obs = parse_json_as_resource(json.dumps(OBSERVATION))
+    assert obs == Observation.parse_obj(OBSERVATION)
+    assert json.loads(obs.json()) == json.loads(obs.json(indent=2))
+    assert json_loads(obs.json().encode()) == json.loads(obs.json())
+
+
+def test_invalid_json_raises_value_error(backend):
+    with pytest.raises(ValueError):
+        json_loads("{not json")
+
+
+def test_select_backend():
+    previous = get_json_backend()
+    try:
+        selected = set_json_backend("auto")
+        assert selected == get_json_backend()
+        # a fast library is preferred over the standard library when installed
+        assert selected == available_json_backends()[min(1, len(available_json_backends()) - 1)]
+        with pytest.raises(ValueError):
+            set_json_backend("simplejson")
+    finally:
+        set_json_backend(previous)
@@ -0,0 +1,78 @@
+import json
+import pickle
+
+import pytest
+from pydantic import ValidationError
+
+from fhirkit import Identifier, LazyResource, Observation, Patient, SimpleFHIRStore
+from fhirkit.Resource import ResourceWithMultiIdentifier
+
+OBSERVATION = {
+    "resourceType": "Observation",
+    "id": "o1",
+    "identifier": [{"system": "http://example.org/obs", "value": "123"}],
+    "code": {"text": "creatinine"},
+    "valueQuantity": {"value": 1.1, "unit": "mg/dL"},
+}
+
+
+def test_eager_fields_dont_materialize():
+    resource = LazyResource(json.dumps(OBSERVATION))
+    assert resource.resourceType == "Observation"
+    assert resource.id == "o1"
+    assert resource.identifier == [Identifier(system="http://example.org/obs", value="123")]
+    assert isinstance(resource, Observation)
+    assert isinstance(resource, ResourceWithMultiIdentifier)
+    assert not isinstance(resource, Patient)
+    assert not resource.is_materialized
+
+
+def test_field_access_materializes():
+    resource = LazyResource(json.dumps(OBSERVATION).encode())
+    assert resource.code.text == "creatinine"
+    assert resource.is_materialized
+    assert resource.materialize() == Observation.parse_obj(OBSERVATION)
+    assert resource == Observation.parse_obj(OBSERVATION)
+
+
+def test_changed_id_survives_materialization():
+    resource = LazyResource(OBSERVATION)
+    resource.id = "o2"
+    assert resource.materialize().id == "o2"
+
+
+def test_pickle_keeps_raw_json():
+    resource = pickle.loads(pickle.dumps(LazyResource(json.dumps(OBSERVATION))))
+    assert isinstance(resource, LazyResource)
+    assert not resource.is_materialized
+    assert resource.value.value == 1.1
+
+
+@pytest.mark.parametrize("raw", ["{not json", '{"resourceType": "Claim"}', "{}", '{"resourceType": {}}'])
+def test_invalid_resource_type_raises(raw):
+    with pytest.raises(ValidationError):
+        LazyResource(raw)
+
+
+def test_invalid_fields_raise_on_materialization():
+    resource = LazyResource({"resourceType": "Observation", "status": "bogus"})
+    with pytest.raises(ValidationError):
+        resource.materialize()
+
+
+def test_single_identifier():
+    identifier = {"system": "urn:ietf:rfc:3986", "value": "urn:uuid:b1"}
+    resource = LazyResource({"resourceType": "Bundle", "type": "collection", "identifier": identifier})
+    assert resource.identifier == Identifier(**identifier)
+    store = SimpleFHIRStore([resource])
+    assert store.get_resource_by_identifier("Bundle", Identifier(**identifier)) is resource
+    assert not resource.is_materialized
+
+
+def test_identifier_assignment_is_kept():
+    identifier = Identifier(system="http://example.org/obs", value="456")
+    resource = LazyResource(json.dumps(OBSERVATION))
+    resource.identifier = [identifier]
+    assert resource.identifier == [identifier]
+    assert resource.materialize().identifier == [identifier]
+    assert json.loads(resource.json_bytes())["identifier"] == [identifier.dict()]
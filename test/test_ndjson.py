@@ -0,0 +1,110 @@
+from pathlib import Path
+
+import pytest
+
+from pydantic import ValidationError
+
+from fhirkit.ndjson import (
+    NDJSONFile,
+    parse_ndjson_lines,
+    resource_type_from_filename,
+    skip_ndjson_line,
+    split_ndjson,
+)
+
+
+def test_split_ndjson_on_line_boundaries(tmp_path):
+    path = tmp_path / "Observation.ndjson"
+    lines = [f'{{"resourceType": "Observation", "id": "{i}"}}\n' for i in range(100)]
+    path.write_text("".join(lines))
+    data = path.read_bytes()
+
+    ranges = list(split_ndjson(path, chunk_size=100))
+    assert len(ranges) > 1
+    assert ranges[0][0] == 0
+    assert ranges[-1][1] == len(data)
+    for (_, end), (start, _) in zip(ranges, ranges[1:]):
+        assert end == start
+    for start, end in ranges:
+        assert data[start:end].endswith(b"\n")
+    assert b"".join(data[start:end] for start, end in ranges) == data
+
+
+def test_split_ndjson_single_chunk(tmp_path):
+    path = tmp_path / "Patient.ndjson"
+    path.write_text('{"resourceType": "Patient"}')
+    assert list(split_ndjson(path, chunk_size=1024)) == [(0, path.stat().st_size)]
+
+
+def test_parse_ndjson_lines():
+    lines = [
+        '{"resourceType": "Patient", "id": "1"}',
+        '{"resourceType": "Observation", "status": "unknown-status"}',
+        '{"resourceType": "Observation", "id": "2", "status": "final", "code": {"text": "bmi"}}',
+    ]
+    results = list(parse_ndjson_lines(lines))
+    assert [i for i, _ in results] == [0, 1, 2]
+    assert results[0][1].id == "1" and isinstance(results[1][1], ValidationError)
+    # every line is yielded, also when it's skipped
+    results = list(parse_ndjson_lines(lines, {"Patient"}, lazy=True))
+    assert [r.id if r is not None else None for _, r in results] == ["1", None, None]
+
+
+def test_resource_type_from_filename():
+    assert resource_type_from_filename(Path("Observation.ndjson")) == "Observation"
+    assert resource_type_from_filename(Path("Observation-002.ndjson")) == "Observation"
+    assert resource_type_from_filename(Path("export.ndjson")) is None
+
+
+def test_skip_ndjson_line():
+    line = '{"resourceType": "Patient", "id": "1"}'
+    assert not skip_ndjson_line(line, None)
+    assert not skip_ndjson_line(line, {"Patient"})
+    assert skip_ndjson_line(line, {"Observation"})
+    assert skip_ndjson_line(line.encode(), {"Observation"})
+    # a contained resource of the requested type means the line has to be parsed
+    contained = '{"resourceType":"Patient","contained":[{"resourceType":"Observation"}]}'
+    assert not skip_ndjson_line(contained, {"Observation"})
+    # lines without resourceType are parsed so they are reported as invalid
+    assert not skip_ndjson_line("{}", {"Observation"})
+
+
+def test_ndjson_file_random_access(tmp_path):
+    path = tmp_path / "Patient.ndjson"
+    path.write_bytes(
+        b'{"resourceType": "Patient", "id": "1"}\n'
+        b'{"resourceType": "Patient", "id": "2"}\r\n'
+        b'{"resourceType": "Patient", "id": "3"}'
+    )
+    with NDJSONFile(path) as f:
+        assert len(f) == 3
+        assert f[1] == b'{"resourceType": "Patient", "id": "2"}'
+        assert f.parse(-1).id == "3"
+        assert [start for start, _, _ in f.ranges(chunk_size=1)] == list(f.offsets[:-1])
+        assert [line for _, _, line in f.ranges(chunk_size=1)] == [0, 1, 2]
+        with pytest.raises(IndexError):
+            f[3]
+    assert not f.index_path.exists()
+
+
+def test_ndjson_file_persisted_index(tmp_path, monkeypatch):
+    path = tmp_path / "Patient.ndjson"
+    path.write_text("".join(f'{{"resourceType": "Patient", "id": "{i}"}}\n' for i in range(10)))
+    with NDJSONFile(path, persist_index=True) as f:
+        offsets = f.offsets
+    assert f.index_path.exists()
+
+    def rescan(self):
+        raise AssertionError("the persisted index should be reused")
+
+    with monkeypatch.context() as m:
+        m.setattr(NDJSONFile, "_build_index", rescan)
+        with NDJSONFile(path) as f:
+            assert f.offsets == offsets
+
+    # an outdated index is rebuilt
+    with open(path, "a") as out:
+        out.write('{"resourceType": "Patient", "id": "10"}\n')
+    with NDJSONFile(path, persist_index=True) as f:
+        assert len(f) == 11
+    assert list(split_ndjson(path, 1, use_index=True)) == list(zip(f.offsets, f.offsets[1:]))
@@ -0,0 +1,59 @@
+import json
+
+import pytest
+from pydantic import ValidationError, parse_obj_as
+
+from fhirkit import Condition, Observation, Patient, ValueSet
+from fhirkit.Bundle import Bundle
+from fhirkit.Resource import RESOURCE_MODELS_BY_TYPE
+from fhirkit.parse import AnyPatientResource, parse_json_as_resource
+
+RESOURCES = [
+    {"resourceType": "Patient", "id": "p1", "gender": "female"},
+    {
+        "resourceType": "Observation",
+        "id": "o1",
+        "subject": {"reference": "Patient/p1"},
+        "code": {"coding": [{"system": "http://loinc.org", "code": "2160-0"}]},
+        "valueQuantity": {"value": 1.1, "unit": "mg/dL"},
+    },
+    {
+        "resourceType": "Condition",
+        "id": "c1",
+        "subject": {"reference": "Patient/p1"},
+        "onsetDateTime": "2012-05-01T10:00:00+01:00",
+    },
+]
+
+
+def test_registry_maps_resource_type_to_model():
+    assert RESOURCE_MODELS_BY_TYPE["Patient"] is Patient
+    assert RESOURCE_MODELS_BY_TYPE["Observation"] is Observation
+    # specialisations of ValueSet don't take over the generic model
+    assert RESOURCE_MODELS_BY_TYPE["ValueSet"] is ValueSet
+    assert "DomainResource" not in RESOURCE_MODELS_BY_TYPE
+
+
+def test_dispatch_matches_discriminated_union():
+    for obj in RESOURCES:
+        parsed = parse_json_as_resource(json.dumps(obj))
+        assert type(parsed) is RESOURCE_MODELS_BY_TYPE[obj["resourceType"]]
+        assert parsed == parse_obj_as(AnyPatientResource, obj)
+    assert isinstance(parse_json_as_resource(json.dumps(RESOURCES[2])), Condition)
+
+
+def test_dispatch_accepts_every_registered_model():
+    bundle = {"resourceType": "Bundle", "type": "collection"}
+    assert isinstance(parse_json_as_resource(json.dumps(bundle)), Bundle)
+    # Bundle is registered after the Union was built
+    with pytest.raises(ValidationError):
+        parse_obj_as(AnyPatientResource, bundle)
+
+
+@pytest.mark.parametrize(
+    "line",
+    ['{"resourceType": "Claim"}', '{"id": "1"}', "[]", "{not json", '{"resourceType": ["Patient"]}'],
+)
+def test_invalid_lines_raise_validation_error(line):
+    with pytest.raises(ValidationError):
+        parse_json_as_resource(line)
@@ -0,0 +1,195 @@
+from datetime import datetime, timedelta, timezone
+from random import Random
+
+import pytest
+
+from fhirkit import (
+    Coding,
+    Condition,
+    Encounter,
+    Observation,
+    Patient,
+    Procedure,
+    SimpleFHIRStore,
+    ValueSet,
+)
+from fhirkit.search import (
+    DATE_PREFIXES,
+    DateIndex,
+    match_date,
+    parse_date_interval,
+    parse_date_search,
+    parse_token,
+)
+
+from .conftest import observation
+
+
+@pytest.fixture
+def store():
+    return SimpleFHIRStore(
+        [
+            Patient(id="p1"),
+            *(
+                Observation.parse_obj(
+                    observation(
+                        i,
+                        patient_id,
+                        code,
+                        effective,
+                        status="final" if i % 2 == 0 else "preliminary",
+                        meta={"lastUpdated": f"2022-01-0{i + 1}T00:00:00Z"},
+                    )
+                )
+                for i, (patient_id, code, effective) in enumerate(
+                    [
+                        ("p1", "2160-0", "2020-01-01T10:00:00Z"),
+                        ("p1", "2160-0", "2020-06-01T10:00:00+02:00"),
+                        ("p2", "2160-0", "2021-01-01T00:00:00Z"),
+                        ("p2", "718-7", "2020-03-01T00:00:00Z"),
+                    ]
+                )
+            ),
+            Condition.parse_obj(
+                {
+                    "resourceType": "Condition",
+                    "id": "c1",
+                    "subject": {"reference": "Patient/p1"},
+                    "clinicalStatus": {
+                        "coding": [
+                            {
+                                "system": "http://terminology.hl7.org/CodeSystem/condition-clinical",
+                                "code": "active",
+                            }
+                        ]
+                    },
+                    "onsetPeriod": {"start": "2019-05-01T00:00:00Z"},
+                }
+            ),
+            Encounter.parse_obj(
+                {
+                    "resourceType": "Encounter",
+                    "id": "e1",
+                    "status": "finished",
+                    "class": {"system": "http://terminology.hl7.org/CodeSystem/v3-ActCode", "code": "AMB"},
+                    "subject": {"reference": "Patient/p2"},
+                    "period": {"start": "2020-02-01T08:00:00Z", "end": "2020-02-01T09:00:00Z"},
+                }
+            ),
+            Procedure.parse_obj(
+                {
+                    "resourceType": "Procedure",
+                    "id": "pr1",
+                    "status": "completed",
+                    "subject": {"reference": "Patient/p1"},
+                    "performedPeriod": {"start": "2020-05-01T08:00:00Z", "end": "2020-05-03T08:00:00Z"},
+                }
+            ),
+        ]
+    )
+
+
+def ids(resources):
+    return [r.id for r in resources]
+
+
+def test_search_token_and_reference(store):
+    assert ids(store.search("Observation", code="http://loinc.org|2160-0")) == ["o0", "o1", "o2"]
+    assert ids(store.search("Observation", code="718-7,http://snomed.info/sct|123")) == ["o3"]
+    assert ids(store.search("Observation", code="http://loinc.org|")) == ["o0", "o1", "o2", "o3"]
+    assert ids(store.search("Observation", code="2160-0", patient="p2")) == ["o2"]
+    assert ids(store.search("Observation", subject="Patient/p1", status="final")) == ["o0"]
+    assert ids(store.search("Observation", subject="http://example.org/fhir/Patient/p2")) == ["o2", "o3"]
+    assert ids(store.search("Condition", clinical_status="active", patient="p1")) == ["c1"]
+    assert ids(store.search("Encounter", **{"class": "AMB"})) == ["e1"]
+    assert ids(store.search("Observation", _id="o1,o3")) == ["o1", "o3"]
+    with pytest.raises(ValueError):
+        store.search("Observation", unknown="1")
+
+
+def test_search_dates(store):
+    assert ids(store.search("Observation", date="2020")) == ["o0", "o1", "o3"]
+    assert ids(store.search("Observation", date=["ge2020-02", "lt2021"])) == ["o1", "o3"]
+    # 10:00+02:00 is 08:00 UTC
+    assert ids(store.search("Observation", date="2020-06-01T08:00:00Z")) == ["o1"]
+    assert ids(store.search("Observation", date="gt2020-12-31", code="2160-0")) == ["o2"]
+    assert ids(store.search("Observation", _lastUpdated="le2022-01-02")) == ["o0", "o1"]
+    # a period without end is ongoing
+    assert ids(store.search("Condition", onset_date="ge2024-01-01")) == ["c1"]
+    assert ids(store.search("Encounter", date="2020-02-01")) == ["e1"]
+    assert ids(store.search("Procedure", date="ge2020-05-02", patient="p1")) == ["pr1"]
+    assert ids(store.search("Procedure", date="2020-05-02")) == []
+
+
+def test_search_index_is_maintained(store):
+    assert ids(store.search("Observation", code="718-7")) == ["o3"]
+    store.put_resource(Observation.parse_obj(observation(4, "p1", "718-7", "2020-04-01T00:00:00Z")))
+    store._replace_resource(4, Observation.parse_obj(observation(3, "p2", "2160-0", "2020-03-01T00:00:00Z")))
+    assert [r.code.coding[0].code for r in store.search("Observation", code="718-7")] == ["718-7"]
+    assert len(store.search("Observation", code="2160-0")) == 4
+
+
+def test_date_search_semantics():
+    utc = timezone.utc
+    assert parse_date_interval("2020-02") == (
+        datetime(2020, 2, 1, tzinfo=utc),
+        datetime(2020, 2, 29, 23, 59, 59, 999999, tzinfo=utc),
+    )
+    assert parse_token("http://loinc.org|2160-0") == ("http://loinc.org", "2160-0")
+    assert parse_token("2160-0") == (None, "2160-0")
+    prefix, search = parse_date_search("lt2020")
+    assert prefix == "lt"
+    assert match_date(prefix, search, parse_date_interval("2019-12-31"))
+    assert not match_date(prefix, search, parse_date_interval("2020-01-01"))
+    with pytest.raises(ValueError):
+        parse_date_search("sa2020")
+
+
+def test_search_codes_and_valuesets(store):
+    assert ids(store.search_codes("Observation", "code", [Coding(system="http://loinc.org", code="718-7")])) == ["o3"]
+    assert ids(store.search_codes("Observation", "code", ["2160-0", ("http://loinc.org", "718-7")])) == [
+        "o0",
+        "o1",
+        "o2",
+        "o3",
+    ]
+    assert ids(store.search_codes("Condition", "clinicalStatus", ["active"])) == ["c1"]
+
+    valueset = ValueSet(
+        url="http://example.org/fhir/ValueSet/hemoglobin",
+        status="active",
+        compose={"include": [{"system": "http://loinc.org", "concept": [{"code": "718-7"}]}]},
+    )
+    assert ids(store.search_valueset("Observation", "code", valueset)) == ["o3"]
+    store.put_resource(valueset)
+    assert ids(store.search("Observation", **{"code:in": valueset.url, "patient": "p2"})) == ["o3"]
+    with pytest.raises(ValueError):
+        store.search("Observation", **{"code:text": "hemoglobin"})
+
+
+def test_date_index_matches_date_search():
+    random = Random(0)
+    day = timedelta(days=1)
+    base = datetime(2020, 1, 1, tzinfo=timezone.utc)
+    entries = []
+    for position in range(200):
+        start = base + random.randrange(100) * day
+        entries.append((position, (start, start + random.randrange(10) * day)))
+    index = DateIndex(entries[:100])
+    for position, interval in entries[100:]:
+        index.add(position, [interval])
+    index.remove(0, [entries[0][1]])
+    for prefix in DATE_PREFIXES:
+        for i in range(0, 110, 7):
+            search = (base + i * day, base + (i + 3) * day)
+            expected = {p for p, interval in entries[1:] if match_date(prefix, search, interval)}
+            assert index.search(prefix, search) == expected
+
+
+def test_search_date_window(store):
+    assert ids(store.search_dates("Observation", "effective", "2020-02-01", "2020-12-31")) == ["o1", "o3"]
+    assert ids(store.search_dates("Observation", "effective", end=datetime(2020, 1, 1, 10))) == ["o0"]
+    # the encounter period overlaps with the window
+    assert ids(store.search_dates("Encounter", "period", "2020-02-01T08:30:00Z", "2020-02-02")) == ["e1"]
+    assert ids(store.search_dates("Condition", "onset", start="2030")) == ["c1"]
+    assert ids(store.search_dates("Observation", "meta.lastUpdated", start="2022-01-04")) == ["o3"]
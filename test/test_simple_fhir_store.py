@@ -0,0 +1,525 @@
+import gzip
+import json
+import logging
+import pickle
+
+import pytest
+
+from fhirkit import (
+    LazyResource,
+    Observation,
+    Patient,
+    SimpleFHIRStore,
+    SnapshotOutdatedError,
+    ValueSet,
+    iter_bulk_export,
+)
+from fhirkit.SimpleFHIRStore import version_key
+from fhirkit.parse import parse_obj_as_resource
+from fhirkit.primitive_datatypes import Instant
+from fhirkit.Server import ResourceNotFoundError
+from fhirkit.elements import CodeableConcept, Identifier, Reference
+
+from .conftest import observation, patient
+
+
+def write_ndjson(path, resources, invalid_lines=()):
+    lines = [json.dumps(r) for r in resources]
+    for i in invalid_lines:
+        lines.insert(i, '{"resourceType": "Observation", "status": "unknown-status"}')
+    path.write_text("\n".join(lines) + "\n")
+
+
+@pytest.fixture
+def bulk_export(tmp_path):
+    write_ndjson(tmp_path / "Patient.ndjson", [patient(i) for i in range(10)])
+    write_ndjson(
+        tmp_path / "Observation.ndjson",
+        [observation(i, f"p{i % 10}") for i in range(50)],
+        invalid_lines=(3, 40),
+    )
+    return tmp_path
+
+
+@pytest.fixture
+def bundles(tmp_path):
+    for i in range(3):
+        resources = [patient(i)] + [observation(i * 10 + j, f"p{i}") for j in range(4)]
+        bundle = {
+            "resourceType": "Bundle",
+            "type": "collection",
+            "entry": [{"fullUrl": f"urn:uuid:{r['id']}", "resource": r} for r in resources],
+        }
+        (tmp_path / f"patient-{i}.json").write_text(json.dumps(bundle))
+    return tmp_path
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_bulk_import(bulk_export, caplog, workers):
+    with caplog.at_level(logging.WARNING):
+        store = SimpleFHIRStore.bulk_import(bulk_export, workers=workers, chunk_size=256)
+    assert len(store) == 60
+    assert sum(isinstance(r, Patient) for r in store) == 10
+    assert sum(isinstance(r, Observation) for r in store) == 50
+    warnings = sorted(r.getMessage() for r in caplog.records if r.levelno == logging.WARNING)
+    assert len(warnings) == 2
+    assert warnings[0].startswith("Couldn't parse line 3 from")
+    assert warnings[1].startswith("Couldn't parse line 40 from")
+
+
+def test_bulk_import_parallel_matches_sequential(bulk_export, caplog):
+    sequential = SimpleFHIRStore.bulk_import(bulk_export)
+    with caplog.at_level(logging.INFO):
+        # small chunks split every file over several workers
+        parallel = SimpleFHIRStore.bulk_import(bulk_export, workers=3, chunk_size=64)
+    # chunks are merged in file order
+    assert [r.dict() for r in parallel] == [r.dict() for r in sequential]
+    assert any("lines/sec" in r.getMessage() for r in caplog.records)
+
+
+def test_bulk_import_with_index(bulk_export):
+    store = SimpleFHIRStore.bulk_import(bulk_export, workers=2, chunk_size=256, index=True)
+    assert len(store) == 60
+    assert (bulk_export / "Observation.ndjson.idx").exists()
+    # the index files are not mistaken for NDJSON files
+    assert len(SimpleFHIRStore.bulk_import(bulk_export, workers=2, index=True)) == 60
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_bulk_import_resource_types(bulk_export, workers):
+    mixed = [patient(100), observation(100, "p100")]
+    write_ndjson(bulk_export / "export.ndjson", mixed)
+    store = SimpleFHIRStore.bulk_import(
+        bulk_export, workers=workers, chunk_size=256, resource_types=["Patient"]
+    )
+    assert len(store) == 11
+    assert all(isinstance(r, Patient) for r in store)
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_bulk_import_lazy(bulk_export, workers):
+    store = SimpleFHIRStore.bulk_import(bulk_export, workers=workers, lazy=True)
+    # the invalid lines have a valid resourceType and are only noticed when materialized
+    assert len(store) == 62
+    assert all(isinstance(r, LazyResource) for r in store)
+    resource = store.get_resource_by_id("o7", resourceType="Observation")
+    assert not resource.is_materialized
+    assert resource.subject.reference == "Patient/p7"
+
+
+def test_load_bundles(bundles):
+    store = SimpleFHIRStore.load_bundles(bundles)
+    assert len(store) == 15
+    observations = SimpleFHIRStore.load_bundles(bundles, resource_types={"Observation"})
+    assert len(observations) == 12
+    assert all(isinstance(r, Observation) for r in observations)
+
+
+def test_load_bundles_skips_invalid(bundles, caplog):
+    (bundles / "settings.json").write_text('{"resourceType": "Patient"}')
+    bundle = {
+        "resourceType": "Bundle",
+        "type": "collection",
+        "entry": [{"fullUrl": "urn:uuid:x", "resource": {"resourceType": "Observation"}}, {}, None, "x", {"resource": "x"}],
+    }
+    (bundles / "invalid.json").write_text(json.dumps(bundle))
+    with caplog.at_level(logging.WARNING):
+        store = SimpleFHIRStore.load_bundles(bundles)
+        assert len(SimpleFHIRStore.load_bundles(bundles, resource_types={"Observation"})) == 12
+    assert len(store) == 15
+    assert len(caplog.records) == 12
+
+
+def test_iter_bulk_export_is_lazy(bulk_export):
+    stream = iter_bulk_export(bulk_export)
+    first = next(stream)
+    assert first.resourceType in ("Patient", "Observation")
+    assert len(list(stream)) == 59
+
+
+def test_iter_bulk_export_filters(bulk_export):
+    observations = list(iter_bulk_export(bulk_export, resource_types=["Observation"]))
+    assert len(observations) == 50
+    subset = list(
+        iter_bulk_export(
+            bulk_export,
+            resource_types={"Observation"},
+            predicate=lambda r: r.subject.reference == "Patient/p1",
+        )
+    )
+    assert sorted(r.id for r in subset) == ["o1", "o11", "o21", "o31", "o41"]
+
+
+def test_from_stream(bulk_export):
+    store = SimpleFHIRStore.from_stream(
+        iter_bulk_export(bulk_export), predicate=lambda r: isinstance(r, Patient)
+    )
+    assert len(store) == 10
+    assert store.get_resource_by_id("p3", resourceType="Patient").id == "p3"
+
+
+def test_snapshot(bulk_export, monkeypatch):
+    snapshot = bulk_export / "store.snapshot"
+    store = SimpleFHIRStore.bulk_import(bulk_export, snapshot=snapshot)
+    assert snapshot.exists()
+
+    restored = SimpleFHIRStore.load_snapshot(snapshot)
+    assert [r.dict() for r in restored] == [r.dict() for r in store]
+
+    def reimport(*args, **kwargs):
+        raise AssertionError("the snapshot should be reused")
+
+    with monkeypatch.context() as m:
+        m.setattr(SimpleFHIRStore, "_bulk_import_sequential", reimport)
+        assert len(SimpleFHIRStore.bulk_import(bulk_export, snapshot=snapshot)) == 60
+        # a snapshot taken with other options isn't reused
+        with pytest.raises(AssertionError):
+            SimpleFHIRStore.bulk_import(bulk_export, snapshot=snapshot, lazy=True)
+
+
+def test_snapshot_outdated(bulk_export):
+    snapshot = bulk_export / "store.snapshot"
+    SimpleFHIRStore.bulk_import(bulk_export).save_snapshot(snapshot)
+    write_ndjson(bulk_export / "Patient-2.ndjson", [patient(100)])
+    with pytest.raises(SnapshotOutdatedError):
+        SimpleFHIRStore.load_snapshot(snapshot)
+    assert len(SimpleFHIRStore.bulk_import(bulk_export, snapshot=snapshot)) == 61
+    assert len(SimpleFHIRStore.load_snapshot(snapshot)) == 61
+
+
+def test_snapshot_unreadable(bulk_export, monkeypatch):
+    snapshot = bulk_export / "store.snapshot"
+    SimpleFHIRStore.bulk_import(bulk_export, snapshot=snapshot)
+    data = snapshot.read_bytes()
+    # a truncated snapshot is imported again and overwritten
+    snapshot.write_bytes(data[: len(data) // 2])
+    assert len(SimpleFHIRStore.bulk_import(bulk_export, snapshot=snapshot)) == 60
+    assert len(SimpleFHIRStore.load_snapshot(snapshot)) == 60
+    data = snapshot.read_bytes()
+
+    # a save that fails halfway keeps the previous snapshot
+    def fail(*args, **kwargs):
+        raise RuntimeError()
+
+    with monkeypatch.context() as m:
+        m.setattr(pickle, "dump", fail)
+        with pytest.raises(RuntimeError):
+            SimpleFHIRStore().save_snapshot(snapshot)
+    assert snapshot.read_bytes() == data
+    assert [p.name for p in bulk_export.iterdir() if p.suffix == ".tmp"] == []
+
+
+def test_sync_bulk_export(bulk_export, caplog):
+    store = SimpleFHIRStore.bulk_import(bulk_export)
+    assert store.sync_bulk_export(bulk_export) == 0
+
+    # a delta is appended to an existing file and delivered in a new file
+    with open(bulk_export / "Patient.ndjson", "a") as f:
+        f.write(json.dumps({**patient(1), "gender": "female"}) + "\n")
+        f.write('{"resourceType": "Patient", "gender": "invalid"}\n')
+    write_ndjson(bulk_export / "Observation-2.ndjson", [observation(100, "p1")])
+    caplog.clear()
+    with caplog.at_level(logging.WARNING):
+        assert store.sync_bulk_export(bulk_export) == 2
+    assert len(store) == 61
+    assert store.get_resource_by_id("p1", "Patient").gender == "female"
+    warnings = [r.getMessage() for r in caplog.records if r.levelno == logging.WARNING]
+    assert len(warnings) == 1
+    assert warnings[0].startswith("Couldn't parse line 11 from")
+
+    # a rewritten file is parsed again
+    write_ndjson(bulk_export / "Patient.ndjson", [patient(0), patient(100)])
+    assert SimpleFHIRStore().sync_bulk_export(bulk_export) == 53
+    assert store.sync_bulk_export(bulk_export) == 2
+    assert len(store) == 62
+    assert store.get_resource_by_id("p0", "Patient").gender is None
+
+
+def test_sync_bulk_export_partial_line(bulk_export, caplog):
+    store = SimpleFHIRStore.bulk_import(bulk_export)
+    line = json.dumps(patient(100))
+    # the writer of the export is halfway a line
+    with open(bulk_export / "Patient.ndjson", "a") as f:
+        f.write(line[:10])
+    caplog.clear()
+    with caplog.at_level(logging.WARNING):
+        assert store.sync_bulk_export(bulk_export) == 0
+        assert store.sync_bulk_export(bulk_export) == 0
+        with open(bulk_export / "Patient.ndjson", "a") as f:
+            f.write(line[10:] + "\n")
+        assert store.sync_bulk_export(bulk_export) == 1
+    assert not [r for r in caplog.records if r.levelno == logging.WARNING]
+    assert store.get_resource_by_id("p100", "Patient") is not None
+    assert len(store) == 61
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+@pytest.mark.parametrize("lazy", [False, True])
+def test_export_ndjson(bulk_export, tmp_path_factory, workers, lazy):
+    store = SimpleFHIRStore.bulk_import(bulk_export, lazy=lazy)
+    store.get_resource_by_id("o1", "Observation").id = "o1-renamed"
+    out = tmp_path_factory.mktemp("export")
+    paths = store.export_ndjson(out, workers=workers, chunk_size=7)
+    assert paths == {"Patient": out / "Patient.ndjson", "Observation": out / "Observation.ndjson"}
+    exported = SimpleFHIRStore.bulk_import(out)
+    # with lazy the invalid lines are kept as proxies, they are exported as is and skipped again on import
+    assert [(r.resourceType, r.id) for r in exported] == [(r.resourceType, r.id) for r in store if r.id is not None]
+    assert exported.get_resource_by_id("o1-renamed", "Observation").code == store.get_resource_by_id("o1", "Observation").code
+    assert [r.dict() for r in exported.filter(lambda r: r.resourceType == "Patient")] == [
+        r.dict() for r in store.filter(lambda r: r.resourceType == "Patient")
+    ]
+
+    paths = store.export_ndjson(out, gzip=True, workers=workers, chunk_size=7)
+    with gzip.open(paths["Patient"], "rt") as f:
+        assert [json.loads(line)["id"] for line in f] == [f"p{i}" for i in range(10)]
+
+
+def test_export_ndjson_lazy_matches_eager(bulk_export, tmp_path_factory):
+    eager = tmp_path_factory.mktemp("eager")
+    SimpleFHIRStore.bulk_import(bulk_export).export_ndjson(eager)
+    # a lazy store of an export writes the same bytes, also for text that isn't ASCII
+    with open(eager / "Patient.ndjson", "ab") as f:
+        f.write(Patient(id="p100", name=[{"family": "Müller"}]).json_bytes() + b"\n")
+    lazy = tmp_path_factory.mktemp("lazy")
+    store = SimpleFHIRStore.bulk_import(eager, lazy=True)
+    store.export_ndjson(lazy)
+    assert not any(r.is_materialized for r in store)
+    for name in ("Patient.ndjson", "Observation.ndjson"):
+        assert (lazy / name).read_bytes() == (eager / name).read_bytes()
+
+
+def test_get_resource_by_id():
+    resources = [Patient(**patient(i)) for i in range(3)] + [Patient(id="p1", gender="male")]
+    store = SimpleFHIRStore(resources)
+    assert store.get_resource_by_id("p1", "Patient") is resources[1]
+    assert store.get_resource_by_literal("Patient/p2") is resources[2]
+    with pytest.raises(ResourceNotFoundError):
+        store.get_resource_by_id("p1", "Observation")
+
+    filtered = store.filter(lambda r: r.gender == "male")
+    assert filtered.get_resource_by_id("p1", "Patient") is resources[3]
+
+    observation = Observation(code={"text": "blood pressure"}, status="final")
+    store.put_resource(observation)
+    assert store.get_resource_by_id(observation.id, "Observation") is observation
+
+
+def test_put_and_delete_resource():
+    store = SimpleFHIRStore([Patient(**patient(i)) for i in range(3)], history=2)
+    view = store.filter(lambda r: r.resourceType == "Patient")
+    cohort = store.cohort("Patient")
+
+    updated = store.put_resource(Patient(id="p1", gender="male", meta={"source": "urn:uuid:1"}))
+    assert updated.meta.versionId == "1" and updated.meta.source == "urn:uuid:1"
+    assert Instant.regex.fullmatch(updated.meta.lastUpdated)
+    assert store.get_resource_by_id("p1", "Patient") is updated
+    assert len(store) == 3 and len(view) == 3
+    for version in ("2", "3"):
+        assert store.put_resource(Patient(id="p1", gender="female")).meta.versionId == version
+    # a version from the source is kept
+    store.put_resource(Patient(id="p1", meta={"versionId": "a"}))
+    assert [r.meta.versionId for r in store.get_resource_history("p1", "Patient")] == ["a", "3", "2"]
+    assert store.get_resource_version("p1", "Patient", "2").gender == "female"
+    with pytest.raises(ResourceNotFoundError):
+        store.get_resource_version("p1", "Patient", "1")
+
+    store.delete_resource("p0", "Patient")
+    with pytest.raises(ResourceNotFoundError):
+        store.get_resource_by_id("p0", "Patient")
+    with pytest.raises(ResourceNotFoundError):
+        store.delete_resource("p0", "Patient")
+    assert [r.id for r in store] == ["p1", "p2"] and len(store) == 2
+    assert [r.id for r in view] == ["p1", "p2"] and len(view) == 2
+    assert [r.id for r in cohort] == ["p1", "p2"] and len(store.cohort()) == 2
+    assert [r.id for r in store.get_resource_history("p0", "Patient")] == ["p0"]
+    assert store.put_resource(Patient(id="p0")).meta.versionId == "1"
+    with pytest.raises(TypeError):
+        view.delete_resource("p1", "Patient")
+
+
+def test_put_resource_changed_in_place():
+    resources = [Patient(**patient(i)) for i in range(2)] + [Observation(**observation(i, "p0")) for i in range(2)]
+    store = SimpleFHIRStore(resources, history=2)
+    store.put_resource(store.get_resource_by_id("o0", "Observation"))
+    # build the search indexes before the resource changes
+    assert len(store.search("Observation", code="http://loinc.org|2160-0", patient="p0")) == 2
+    assert len(store.search_dates("Observation", "meta.lastUpdated", start="2000")) == 1
+
+    resource = store.get_resource_by_id("o0", "Observation")
+    resource.subject = Reference(reference="Patient/p1")
+    resource.code = CodeableConcept(coding=[{"system": "http://loinc.org", "code": "718-7"}])
+    assert store.put_resource(resource) is resource
+    assert resource.meta.versionId == "2"
+    assert [r.id for r in store.search("Observation", code="http://loinc.org|2160-0")] == ["o1"]
+    assert [r.id for r in store.search("Observation", code="http://loinc.org|718-7", patient="p1")] == ["o0"]
+    assert [r.id for r in store.search("Observation", patient="p0")] == ["o1"]
+    assert [e.resource.id for e in store.patient("p1").entry] == ["p1", "o0"]
+    assert [r.id for r in store.search_dates("Observation", "meta.lastUpdated", start="2000")] == ["o0"]
+
+    resource.code = CodeableConcept(coding=[{"system": "http://loinc.org", "code": "4548-4"}])
+    store.put_resource(resource)
+    history = store.get_resource_history("o0", "Observation")
+    assert [r.meta.versionId for r in history] == ["3", "2", "1"]
+    assert history[1].code.coding[0].code == "718-7" and history[1].subject.reference == "Patient/p1"
+    # the fields that weren't set are readable on the previous versions too
+    assert history[1].valueQuantity is None and history[2].category == []
+    store.delete_resource("o0", "Observation")
+    assert store.search("Observation", code="http://loinc.org|4548-4") == []
+
+
+def test_duplicate_ids():
+    mrn = Identifier(system="urn:oid:1.2.3", value="123")
+    resources = [Patient(id="a", identifier=[mrn]), Patient(id="a", identifier=[mrn], gender="male")]
+    store = SimpleFHIRStore(resources)
+    # the next resource with the key takes over when the first one goes
+    store.delete_resource("a", "Patient")
+    assert len(store) == 1
+    assert store.get_resource_by_id("a", "Patient") is resources[1]
+    assert store.get_resource_by_identifier("Patient", mrn) is resources[1]
+    store._replace_resource(1, Patient(id="a"))
+    assert store.get_resource_by_id("a", "Patient").gender is None
+    with pytest.raises(ResourceNotFoundError):
+        store.get_resource_by_identifier("Patient", mrn)
+    store.delete_resource("a", "Patient")
+    with pytest.raises(ResourceNotFoundError):
+        store.get_resource_by_id("a", "Patient")
+    assert store._duplicate_positions == {}
+
+
+def test_get_resource_by_identifier():
+    mrn = {"system": "urn:oid:1.2.3", "value": "123"}
+    resources = [
+        Patient(id="p1", identifier=[{"system": "urn:oid:9.9", "value": "123"}]),
+        Patient(id="p2", identifier=[{**mrn, "use": "official"}]),
+    ]
+    store = SimpleFHIRStore(resources)
+    assert store.get_resource_by_identifier("Patient", Identifier(**mrn)) is resources[1]
+    with pytest.raises(ResourceNotFoundError):
+        store.get_resource_by_identifier("Observation", Identifier(**mrn))
+
+    reference = Reference(type="Patient", identifier=mrn)
+    assert reference.resolve(store) is resources[1]
+
+    # a resource that is replaced on sync is reindexed
+    store._replace_resource(1, Patient(id="p2"))
+    with pytest.raises(ResourceNotFoundError):
+        store.get_resource_by_identifier("Patient", Identifier(**mrn))
+
+
+def test_get_resource_by_canonical():
+    url = "http://example.org/fhir/ValueSet/labs"
+    resources = [
+        ValueSet(id=f"vs{i}", url=url, version=version, status="active")
+        for i, version in enumerate(["1.10.0", None, "1.9.2", "1.10.0"])
+    ]
+    store = SimpleFHIRStore(resources)
+    assert store.get_resource_by_canonical(url) is resources[0]
+    assert store.get_resource_by_canonical(f"{url}|1.9.2") is resources[2]
+    with pytest.raises(ResourceNotFoundError):
+        store.get_resource_by_canonical(f"{url}|2.0.0")
+
+    store._replace_resource(0, Patient(id="p0"))
+    assert store.get_resource_by_canonical(url) is resources[3]
+    assert version_key("1.0") < version_key("1.0.1") < version_key("1.1")
+
+
+def count_entries(bundle):
+    return len(bundle.entry)
+
+
+@pytest.mark.parametrize("lazy", [False, True])
+def test_patient_compartment(bulk_export, lazy):
+    store = SimpleFHIRStore.bulk_import(bulk_export, lazy=lazy)
+    # compartments of lazy resources are found without validating them
+    assert not any(isinstance(r, LazyResource) and r.is_materialized for r in store)
+    assert sorted(store.patient_ids()) == sorted(f"p{i}" for i in range(10))
+    bundle = store.patient("p1")
+    assert bundle.type == "collection"
+    resources = [entry.resource for entry in bundle.entry]
+    assert [r.resourceType for r in resources] == ["Patient"] + ["Observation"] * 5
+    assert all(r.subject.reference == "Patient/p1" for r in resources[1:])
+    assert store.patient("unknown").entry == []
+
+    # compartments are kept up to date on sync
+    write_ndjson(bulk_export / "Observation-2.ndjson", [observation(100, "p1"), observation(1, "p2")])
+    store.sync_bulk_export(bulk_export, lazy=lazy)
+    assert len(store.patient("p1").entry) == 6
+    assert len(store.patient("p2").entry) == 7
+
+
+@pytest.mark.parametrize("lazy", [False, True])
+def test_patient_compartment_urn_uuid(lazy):
+    pid = "1b5c4e0b-7f3a-4c1e-9d55-2f1f0a3a6c11"
+    resources = [
+        {**observation(1, pid), "subject": {"reference": f"urn:uuid:{pid}"}},
+        {**patient(1), "id": pid},
+        {**observation(2, pid), "subject": {"reference": f"urn:uuid:{pid}"}},
+        {**observation(3, pid), "subject": {"reference": "urn:uuid:unknown"}},
+    ]
+    store = SimpleFHIRStore([LazyResource(r) if lazy else parse_obj_as_resource(r) for r in resources])
+    assert store.patient_ids() == [pid]
+    assert [e.resource.id for e in store.patient(pid).entry] == ["o1", pid, "o2"]
+    assert not any(isinstance(r, LazyResource) and r.is_materialized for r in store)
+    assert [r.id for r in store.search("Observation", patient=pid)] == ["o1", "o2"]
+    assert [r.id for r in store.search("Observation", subject=f"urn:uuid:{pid}")] == ["o1", "o2"]
+    assert list(store.patients("Observation")) == [pid]
+
+    store.delete_resource("o1", "Observation")
+    store.put_resource(Observation(**observation(3, "unknown")))
+    assert [e.resource.id for e in store.patient(pid).entry] == [pid, "o2"]
+
+
+def test_map_patients(bulk_export):
+    store = SimpleFHIRStore.bulk_import(bulk_export)
+    expected = {f"p{i}": 6 for i in range(10)}
+    assert store.map_patients(count_entries) == expected
+    assert store.map_patients(count_entries, workers=2) == expected
+
+
+def test_filter_returns_a_view(bulk_export):
+    store = SimpleFHIRStore.bulk_import(bulk_export)
+    calls = []
+
+    def is_observation(r):
+        calls.append(r)
+        return r.resourceType == "Observation"
+
+    view = store.filter(is_observation).filter(lambda r: r.subject.reference == "Patient/p1")
+    # chained filters are only evaluated when the view is used, in a single pass
+    assert calls == []
+    assert len(view) == 5
+    assert len(calls) == len(store)
+    assert all(r is store.get_resource_by_id(r.id, "Observation") for r in view)
+
+    assert view.get_resource_by_id("o11", "Observation").id == "o11"
+    with pytest.raises(ResourceNotFoundError):
+        view.get_resource_by_id("o2", "Observation")
+    assert [r.id for r in view.search("Observation", code="2160-0")] == [r.id for r in view]
+    assert view.patient_ids() == ["p1"]
+
+    narrowed = view.filter(lambda r: r.id != "o1")
+    assert len(narrowed) == 4 and list(narrowed.positions) == list(view.positions[1:])
+
+    copy = narrowed.materialize()
+    assert type(copy) is SimpleFHIRStore and len(copy) == 4
+
+    # resources that change in the store are evaluated again
+    store.put_resource(Observation(**observation(11, "p2")))
+    store.put_resource(Observation(**observation(100, "p1")))
+    store.delete_resource("o21", "Observation")
+    assert [r.id for r in view] == ["o1", "o31", "o41", "o100"]
+    assert [r.id for r in narrowed] == ["o31", "o41", "o100"]
+    assert [r.id for r in narrowed.filter(lambda r: r.id != "o100")] == ["o31", "o41"]
+    with pytest.raises(ResourceNotFoundError):
+        view.get_resource_by_id("o11", "Observation")
+    with pytest.raises(TypeError):
+        view.put_resource(Patient(id="p100"))
+
+    # the changes every view has seen are dropped from the log
+    del narrowed, copy
+    for i in range(2000):
+        store.put_resource(Patient(id="p1"))
+        if i == 1000:
+            assert len(view) == 4
+    assert len(store._changed_positions) < 2000
+    assert [r.id for r in view] == ["o1", "o31", "o41", "o100"]